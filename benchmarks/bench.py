@@ -0,0 +1,406 @@
+"""FDA 推送流程基准测试
+
+用 fixtures/ 中录制格式的 OpenFDA 响应按规模（默认 10、1000、100000 条/端点）
+合成数据，由本地模拟服务同时充当 OpenFDA 和飞书 Webhook。每个场景用 run_cycle 执行
+一轮与生产相同的 获取 → 解析 → 归档 → 去重 → 格式化 → 发送 流程（单个端点，或 all
+场景中全部端点一起），记录吞吐量、各阶段耗时和内存峰值。计时之前先不计时地预热一遍。
+另外在子进程中测量 import main 的冷启动耗时。结果与 baseline.json 比较，超出容差时
+以非零状态退出。
+
+    python benchmarks/bench.py                      # 运行并与基准比较
+    python benchmarks/bench.py --sizes 10,1000      # 只跑较小的规模
+    python benchmarks/bench.py --update-baseline    # 把本次结果写为新的基准
+
+限流器在基准测试中被替换为不限速，测量的是代码本身的开销。
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+BENCH_DIR = Path(__file__).resolve().parent
+FIXTURES_DIR = BENCH_DIR / "fixtures"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+
+# 导入 main 之前把状态目录指向临时目录，并关闭关注列表和目的地配置
+WORK_DIR = Path(tempfile.mkdtemp(prefix="fda_bench_"))
+os.environ["FDA_DATA_DIR"] = str(WORK_DIR / "data")
+os.environ["FDA_WATCHLIST"] = str(WORK_DIR / "watchlist.txt")
+os.environ["FDA_DESTINATIONS"] = str(WORK_DIR / "destinations.json")
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+import main  # noqa: E402
+
+DEFAULT_SIZES = [10, 1000, 100000]
+
+# 各端点对应的录制响应文件
+FIXTURES = {
+    "drugs": "drug_event.json",
+    "enforcement": "drug_enforcement.json",
+    "label": "drug_label.json",
+    "drugsfda": "drug_drugsfda.json",
+    "device_enforcement": "device_enforcement.json",
+    "device_event": "device_event.json",
+    "food_enforcement": "food_enforcement.json",
+}
+
+# 全部端点一起经过摄取流水线的场景名称
+ALL_ENDPOINTS = "all"
+
+# 计时之前不计时预热时每个场景使用的记录数
+WARM_UP_SIZE = 10
+
+# 各端点在 OpenFDA 上的路径，模拟服务按 /<规模><路径> 提供数据
+ENDPOINT_PATHS = {
+    endpoint_type: urlparse(endpoint).path
+    for endpoint_type, endpoint in main.OPENFDA_ENDPOINTS.items()
+}
+
+# 耗时和内存超过基准的倍数，以及耗时的绝对余量（秒，避免小规模场景的抖动误报）
+DEFAULT_TOLERANCE = 1.5
+TIME_SLACK = 0.05
+
+# 在子进程中测量 import main 的耗时（或内存峰值），冷启动时每次都要付出这部分开销
+IMPORT_SNIPPET = """
+import sys, time, tracemalloc
+if sys.argv[1] == "memory":
+    tracemalloc.start()
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(seconds, tracemalloc.get_traced_memory()[1])
+"""
+
+
+def load_templates(endpoint_type):
+    """读取录制的响应，返回 [(记录 JSON 文本, 原始 ID)]，合成数据时替换 ID"""
+    with open(FIXTURES_DIR / FIXTURES[endpoint_type], encoding="utf-8") as f:
+        results = json.load(f)["results"]
+    id_field = main.RECORD_SPECS[endpoint_type]["id_field"]
+    return [
+        (json.dumps(item, ensure_ascii=False), json.dumps(item[id_field]))
+        for item in results
+    ]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟 OpenFDA 和飞书
+
+    GET /<规模>/<OpenFDA 路径>?limit=&skip= 返回合成的一页记录，还有更多记录时
+    通过 Link 头返回 search_after 游标；POST /hook 模拟飞书 Webhook。
+    """
+
+    templates = {}
+    # 每个 OpenFDA 请求的模拟网络延迟（秒）
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        size, _, path = url.path.lstrip("/").partition("/")
+        templates = self.templates.get("/" + path)
+        if templates is None or not size.isdigit():
+            self._send(404, b'{"error": {"code": "NOT_FOUND"}}')
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        total = int(size)
+        limit = int(query.get("limit", 1))
+        start = int(query.get("search_after", query.get("skip", 0)))
+        end = min(total, start + limit)
+        if start >= total:
+            self._send(404, b'{"error": {"code": "NOT_FOUND"}}')
+            return
+
+        records = []
+        for index in range(start, end):
+            text, record_id = templates[index % len(templates)]
+            records.append(text.replace(record_id, f'"{record_id[1:-1]}-{index}"', 1))
+        meta = {"results": {"skip": start, "limit": limit, "total": total}}
+        body = (
+            f'{{"meta": {json.dumps(meta)}, "results": [{", ".join(records)}]}}'
+        ).encode("utf-8")
+
+        headers = []
+        if end < total:
+            host = self.headers.get("Host")
+            next_url = f"http://{host}/{size}/{path}?search_after={end}&limit={limit}"
+            headers.append(("Link", f'<{next_url}>; rel="next"'))
+        self._send(200, body, headers)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send(200, b'{"code": 0, "msg": "success"}')
+
+
+def run_mock_server(port_queue, latency=0.0):
+    """在子进程中运行模拟服务，避免与被测代码争用 GIL"""
+    MockHandler.latency = latency
+    MockHandler.templates = {
+        ENDPOINT_PATHS[endpoint_type]: load_templates(endpoint_type)
+        for endpoint_type in FIXTURES
+    }
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def run_pipeline(endpoint_type, size, base_url):
+    """对一个端点（或 ALL_ENDPOINTS 表示全部端点）各获取 size 条，经过 run_cycle 的
+    摄取流水线推送，返回 (耗时秒数, 推送的记录数, 获取的记录数)"""
+    workdir = Path(tempfile.mkdtemp(dir=WORK_DIR))
+    for name, path in ENDPOINT_PATHS.items():
+        main.OPENFDA_ENDPOINTS[name] = f"{base_url}/{size}{path}"
+    main._response_cache = main.ResponseCache(path=workdir / "http_cache.db")
+    seen_store = main.SeenStore(path=workdir / "fda_state.db")
+    outbox = main.Outbox(path=workdir / "fda_state.db")
+    archive = main.RecordArchive(path=workdir / "fda_archive.db")
+    config = main.get_config()
+    config.fetch_limit = size
+    endpoints = FIXTURES if endpoint_type == ALL_ENDPOINTS else [endpoint_type]
+    report_types = [
+        (endpoint, main.RECORD_SPECS[endpoint]["name"]) for endpoint in endpoints
+    ]
+    try:
+        start = time.perf_counter()
+        success, failed, errors = main.run_cycle(
+            report_types, seen_store, outbox, archive
+        )
+        elapsed = time.perf_counter() - start
+        if failed or success != len(report_types):
+            raise RuntimeError(f"{endpoint_type} 推送失败: {errors}")
+        archived = dict(archive.query(group_by="endpoint"))
+        if archived != {endpoint: size for endpoint in endpoints}:
+            raise RuntimeError(f"{endpoint_type} 归档的记录数不正确: {archived}")
+        pushed = min(size, config.max_push_records) * len(report_types)
+        return elapsed, pushed, size * len(report_types)
+    finally:
+        seen_store.close()
+        outbox.close()
+        archive.close()
+        main._response_cache.close()
+        main._response_cache = None
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def warm_up(endpoints, base_url, size=WARM_UP_SIZE):
+    """不计时地把每个场景跑一遍小规模数据，让 requests 的导入、HTTP 会话和连接池、
+    提取器等一次性开销不计入第一个场景"""
+    for endpoint_type in endpoints:
+        run_pipeline(endpoint_type, size, base_url)
+    main.metrics = main.Metrics()
+
+
+def run_scenario(endpoint_type, size, base_url, repeat):
+    """运行一个场景：重复 repeat 次取最快的一次计时，再单独跑一次测量内存峰值"""
+    best = None
+    for _ in range(repeat):
+        main.metrics = main.Metrics()
+        seconds, pushed, fetched = run_pipeline(endpoint_type, size, base_url)
+        if best is None or seconds < best[0]:
+            best = (seconds, pushed, main.metrics.snapshot())
+    seconds, pushed, snapshot = best
+
+    # tracemalloc 会明显拖慢执行，因此不和计时放在同一次运行中
+    tracemalloc.start()
+    try:
+        run_pipeline(endpoint_type, size, base_url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    downloaded = sum(
+        entry["value"]
+        for entry in snapshot["counters"].get("fda_download_bytes_total", [])
+    )
+    return {
+        "seconds": round(seconds, 4),
+        "records_per_second": round(fetched / seconds, 1),
+        "pushed": pushed,
+        "downloaded_mb": round(downloaded / 1024**2, 2),
+        "peak_mb": round(peak / 1024**2, 2),
+        "stages": snapshot["stages"],
+    }
+
+
+def measure_import(repeat):
+    """测量冷启动导入 main 模块的耗时（取最快一次）和内存峰值"""
+
+    def run(mode):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET, mode],
+            cwd=BENCH_DIR.parent,
+            env=os.environ,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        return float(output[0]), int(output[1])
+
+    seconds = min(run("time")[0] for _ in range(repeat))
+    _, peak = run("memory")
+    return {"seconds": round(seconds, 4), "peak_mb": round(peak / 1024**2, 2)}
+
+
+def check_regressions(results, baseline, tolerance):
+    """与基准比较，返回回归描述列表"""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        limit = expected["seconds"] * tolerance + TIME_SLACK
+        if result["seconds"] > limit:
+            regressions.append(
+                f"{name}: 耗时 {result['seconds']:.3f}s 超过基准 "
+                f"{expected['seconds']:.3f}s 的 {tolerance} 倍"
+            )
+        if result["peak_mb"] > expected["peak_mb"] * tolerance + 1:
+            regressions.append(
+                f"{name}: 内存峰值 {result['peak_mb']:.1f}MB 超过基准 "
+                f"{expected['peak_mb']:.1f}MB 的 {tolerance} 倍"
+            )
+    return regressions
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="FDA 推送流程基准测试")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="每个端点的记录数，逗号分隔（默认 10,1000,100000）",
+    )
+    parser.add_argument(
+        "--endpoints",
+        default=",".join([*FIXTURES, ALL_ENDPOINTS]),
+        help=f"要测试的端点，逗号分隔，{ALL_ENDPOINTS} 表示全部端点一起（默认全部场景）",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="计时重复次数，取最快一次"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="超过基准多少倍视为回归（默认 1.5）",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="模拟服务对每个 OpenFDA 请求增加的延迟（毫秒），用于观察网络等待下的并发效果",
+    )
+    parser.add_argument("--output", help="把本次结果写入该 JSON 文件")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="把本次结果合并写入 baseline.json",
+    )
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    endpoints = args.endpoints.split(",")
+
+    logging.disable(logging.INFO)
+    # 基准测试只测代码本身，不限速
+    main.openfda_limiter = main.TokenBucket(10**9)
+    main.get_config().feishu_rate_limit = 10**9
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=run_mock_server, args=(port_queue, args.latency / 1000), daemon=True
+    )
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+    main.get_config().feishu_webhook = f"{base_url}/hook"
+
+    results = {}
+    try:
+        result = measure_import(max(args.repeat, 5))
+        results["import"] = result
+        print(
+            f"{'import':<26} {result['seconds']:>9.3f}s "
+            f"{'':>32} {result['peak_mb']:>8.2f}MB 峰值"
+        )
+        warm_up(endpoints, base_url)
+        for size in sizes:
+            for endpoint_type in endpoints:
+                name = f"{endpoint_type}-{size}"
+                result = run_scenario(endpoint_type, size, base_url, args.repeat)
+                results[name] = result
+                print(
+                    f"{name:<26} {result['seconds']:>9.3f}s "
+                    f"{result['records_per_second']:>11.1f} 条/秒 "
+                    f"{result['downloaded_mb']:>8.2f}MB 下载 "
+                    f"{result['peak_mb']:>8.2f}MB 峰值"
+                )
+                stages = "  ".join(
+                    f"{stage[len('fda_'):-len('_seconds')]}={seconds:.3f}"
+                    for stage, seconds in result["stages"].items()
+                )
+                print(f"{'':<26} {stages}")
+    finally:
+        server.terminate()
+        main.close_http_session()
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    baseline = {}
+    if BASELINE_FILE.exists():
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.latency:
+        print("模拟了网络延迟，不与基准比较")
+        return 0
+
+    if args.update_baseline:
+        baseline.update(
+            {
+                name: {key: result[key] for key in ("seconds", "peak_mb")}
+                for name, result in results.items()
+            }
+        )
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"已更新基准: {BASELINE_FILE}")
+        return 0
+
+    regressions = check_regressions(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if regressions:
+        return 1
+    print("✅ 没有发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
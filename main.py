@@ -1,69 +1,1232 @@
-import requests
 import json
 from datetime import datetime, timedelta
+import codecs
+import hashlib
+import itertools
 import os
+import re
 import logging
+import math
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote, unquote_plus, urlparse
 
-# 配置日志
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-log_file = log_dir / f"fda_{datetime.now().strftime('%Y%m%d')}.log"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()],
-)
+# requests、argparse、http.server、email 等导入较慢的模块在首次使用时才导入，
+# 导入本模块时不创建目录、不打开日志文件，也不读取环境变量（见 Config）
 logger = logging.getLogger(__name__)
 
-# 飞书 Webhook URL - 从环境变量读取（必须配置）
-FEISHU_WEBHOOK = os.getenv("FEISHU_WEBHOOK")
-
 # OpenFDA API 端点
 OPENFDA_ENDPOINTS = {
     "drugs": "https://api.fda.gov/drug/event.json",
     "enforcement": "https://api.fda.gov/drug/enforcement.json",
     "label": "https://api.fda.gov/drug/label.json",
+    "drugsfda": "https://api.fda.gov/drug/drugsfda.json",
+    "device_enforcement": "https://api.fda.gov/device/enforcement.json",
+    "device_event": "https://api.fda.gov/device/event.json",
+    "food_enforcement": "https://api.fda.gov/food/enforcement.json",
 }
 
+# 分页大小（OpenFDA 单页最多 1000 条）和 skip 分页上限
+PAGE_SIZE = 1000
+MAX_SKIP = 25000
+
+# 投影后记录中保存章节内容哈希的字段，以及去重时写入的变更说明字段
+SECTION_HASHES_KEY = "_sections"
+CHANGES_KEY = "_changes"
+
+# 各端点的记录提取规则（新增端点只需在这里添加配置）
+# - name / emoji: 报告类型的显示名称和图标
+# - date_field: 用于日期窗口过滤和排序的字段；date_latest=True 表示该字段位于列表中
+#   （如药品审批的各次提交），取其中最新的日期
+# - id_field: 记录的唯一标识，用于跨运行去重和生成链接
+# - title: 标题字段，以及为空时的默认值和截断宽度
+# - fields: 依次显示的字段；date 表示把 YYYYMMDD 格式化为 YYYY-MM-DD，
+#   fmt 为显示模板，text=False 表示只在带链接的富文本消息中显示，
+#   latest=True 表示路径经过列表时取所有值中最大（最新）的一个
+# - link / search_link: 有 ID 时的详情链接，以及没有 ID 时按标题搜索的链接
+# - archive: 归档时单独建索引的列（classification / manufacturer）及其字段路径（可选）
+# - watch: 关注列表匹配的字段路径，路径经过的列表会展开为其中每个元素（可选）
+# - count_fields: 数据摘要中用 count= 查询统计的字段（可选）
+# - pairs: 不良事件的药品列表和反应列表路径（列表.字段），归档时展开为药品×反应组合，
+#   用于安全信号检测（可选）
+# - keep: 流式解析时除上述字段外额外保留的顶层字段（可选）
+# - version_field / sections: 记录的版本号字段，以及需要比较的章节字段及其显示名称（可选）。
+#   流式解析时各章节只保留内容哈希，去重时按版本号和章节哈希识别修订并生成章节级差异
+# 字段路径用点号分隔，数字表示列表下标，如 patient.drug.0.medicinalproduct
+
+# 药品、器械和食品召回（enforcement）端点的记录结构相同，共用显示字段和统计字段
+RECALL_FIELDS = [
+    {
+        "key": "reason",
+        "label": "原因",
+        "path": "reason_for_recall",
+        "default": "未说明",
+        "width": 50,
+    },
+    {"key": "date", "label": "日期", "path": "report_date"},
+    {
+        "key": "classification",
+        "label": "级别",
+        "path": "classification",
+        "fmt": "Class {}",
+    },
+    {"key": "id", "label": "召回编号", "path": "recall_number", "text": False},
+]
+RECALL_ARCHIVE = {"classification": "classification", "manufacturer": "recalling_firm"}
+RECALL_COUNT_FIELDS = [
+    {"field": "classification.exact", "label": "级别"},
+    {"field": "recalling_firm.exact", "label": "召回企业"},
+]
+
+RECORD_SPECS = {
+    "drugs": {
+        "name": "药品不良事件",
+        "emoji": "⚠️",
+        "date_field": "receivedate",
+        "id_field": "safetyreportid",
+        "title": {"path": "patient.drug.0.medicinalproduct", "default": "未知药品"},
+        "fields": [
+            {
+                "key": "reaction",
+                "label": "反应",
+                "path": "patient.reaction.0.reactionmeddrapt",
+            },
+            {
+                "key": "date",
+                "label": "日期",
+                "path": "receivedate",
+                "date": True,
+                "text": False,
+            },
+            {"key": "id", "label": "报告ID", "path": "safetyreportid", "text": False},
+        ],
+        "count_fields": [
+            {"field": "patient.drug.medicinalproduct.exact", "label": "药品"},
+            {"field": "patient.reaction.reactionmeddrapt.exact", "label": "反应"},
+        ],
+        "pairs": {
+            "drug": "patient.drug.medicinalproduct",
+            "reaction": "patient.reaction.reactionmeddrapt",
+        },
+        "watch": [
+            "patient.drug.medicinalproduct",
+            "patient.drug.openfda.brand_name",
+            "patient.drug.openfda.generic_name",
+            "patient.drug.openfda.manufacturer_name",
+            "patient.drug.openfda.product_ndc",
+        ],
+        "link": "https://open.fda.gov/apis/drug/event/explore/?search=safetyreportid:{id}",
+        "search_link": "https://open.fda.gov/apis/drug/event/explore/?search=patient.drug.medicinalproduct:{query}",
+    },
+    "enforcement": {
+        "name": "警告信",
+        "emoji": "🚨",
+        "date_field": "report_date",
+        "id_field": "recall_number",
+        "title": {"path": "product_description", "default": "未知产品", "width": 80},
+        "fields": RECALL_FIELDS,
+        "archive": RECALL_ARCHIVE,
+        "count_fields": RECALL_COUNT_FIELDS,
+        "watch": [
+            "product_description",
+            "recalling_firm",
+            "openfda.brand_name",
+            "openfda.generic_name",
+            "openfda.manufacturer_name",
+            "openfda.product_ndc",
+        ],
+        "link": "https://open.fda.gov/apis/drug/enforcement/explore/?search=recall_number:{id}",
+        "search_link": "https://open.fda.gov/apis/drug/enforcement/explore/?search=product_description:{query}",
+        "search_width": 50,
+    },
+    "label": {
+        "name": "药品标签",
+        "emoji": "💊",
+        "date_field": "effective_time",
+        "id_field": "set_id",
+        "title": {"path": "openfda.brand_name.0", "default": "未知"},
+        "fields": [
+            {
+                "key": "generic_name",
+                "label": "通用名",
+                "path": "openfda.generic_name.0",
+            },
+            {
+                "key": "manufacturer",
+                "label": "制造商",
+                "path": "openfda.manufacturer_name.0",
+                "width": 40,
+            },
+            {"key": "changes", "label": "变更", "path": CHANGES_KEY},
+            {
+                "key": "date",
+                "label": "生效日期",
+                "path": "effective_time",
+                "date": True,
+                "text": False,
+            },
+        ],
+        "archive": {"manufacturer": "openfda.manufacturer_name.0"},
+        "version_field": "version",
+        "sections": {
+            "boxed_warning": "黑框警告",
+            "indications_and_usage": "适应症",
+            "dosage_and_administration": "用法用量",
+            "dosage_forms_and_strengths": "剂型和规格",
+            "contraindications": "禁忌",
+            "warnings_and_cautions": "警告和注意事项",
+            "warnings": "警告",
+            "precautions": "注意事项",
+            "adverse_reactions": "不良反应",
+            "drug_interactions": "药物相互作用",
+            "use_in_specific_populations": "特殊人群用药",
+            "overdosage": "药物过量",
+        },
+        "count_fields": [
+            {"field": "openfda.manufacturer_name.exact", "label": "制造商"},
+            {"field": "openfda.product_type.exact", "label": "产品类型"},
+        ],
+        "watch": [
+            "openfda.brand_name",
+            "openfda.generic_name",
+            "openfda.manufacturer_name",
+            "openfda.product_ndc",
+        ],
+        "link": "https://dailymed.nlm.nih.gov/dailymed/drugInfo.cfm?setid={id}",
+        "search_link": "https://dailymed.nlm.nih.gov/dailymed/search.cfm?labeltype=all&query={query}",
+    },
+    "drugsfda": {
+        "name": "药品审批",
+        "emoji": "📋",
+        "date_field": "submissions.submission_status_date",
+        "date_latest": True,
+        "id_field": "application_number",
+        "title": {"path": "products.0.brand_name", "default": "未知药品"},
+        "fields": [
+            {
+                "key": "generic_name",
+                "label": "通用名",
+                "path": "openfda.generic_name.0",
+            },
+            {"key": "sponsor", "label": "申请人", "path": "sponsor_name", "width": 40},
+            {
+                "key": "date",
+                "label": "最近提交",
+                "path": "submissions.submission_status_date",
+                "latest": True,
+                "date": True,
+            },
+            {
+                "key": "id",
+                "label": "申请号",
+                "path": "application_number",
+                "text": False,
+            },
+        ],
+        "archive": {"manufacturer": "sponsor_name"},
+        "count_fields": [
+            {"field": "sponsor_name.exact", "label": "申请人"},
+            {"field": "products.dosage_form.exact", "label": "剂型"},
+        ],
+        "watch": [
+            "products.brand_name",
+            "products.active_ingredients.name",
+            "sponsor_name",
+            "openfda.generic_name",
+            "openfda.product_ndc",
+        ],
+        "link": "https://open.fda.gov/apis/drug/drugsfda/explore/?search=application_number:{id}",
+        "search_link": "https://open.fda.gov/apis/drug/drugsfda/explore/?search=products.brand_name:{query}",
+    },
+    "device_enforcement": {
+        "name": "器械召回",
+        "emoji": "🩺",
+        "date_field": "report_date",
+        "id_field": "recall_number",
+        "title": {"path": "product_description", "default": "未知产品", "width": 80},
+        "fields": RECALL_FIELDS,
+        "archive": RECALL_ARCHIVE,
+        "count_fields": RECALL_COUNT_FIELDS,
+        "watch": ["product_description", "recalling_firm", "openfda.device_name"],
+        "link": "https://open.fda.gov/apis/device/enforcement/explore/?search=recall_number:{id}",
+        "search_link": "https://open.fda.gov/apis/device/enforcement/explore/?search=product_description:{query}",
+        "search_width": 50,
+    },
+    "device_event": {
+        "name": "器械不良事件",
+        "emoji": "📟",
+        "date_field": "date_received",
+        "id_field": "mdr_report_key",
+        "title": {"path": "device.0.brand_name", "default": "未知器械"},
+        "fields": [
+            {"key": "event_type", "label": "事件类型", "path": "event_type"},
+            {
+                "key": "generic_name",
+                "label": "通用名",
+                "path": "device.0.generic_name",
+                "width": 40,
+            },
+            {
+                "key": "manufacturer",
+                "label": "制造商",
+                "path": "device.0.manufacturer_d_name",
+                "width": 40,
+            },
+            {
+                "key": "date",
+                "label": "日期",
+                "path": "date_received",
+                "date": True,
+                "text": False,
+            },
+            {"key": "id", "label": "报告编号", "path": "mdr_report_key", "text": False},
+        ],
+        "archive": {
+            "classification": "event_type",
+            "manufacturer": "device.0.manufacturer_d_name",
+        },
+        "count_fields": [
+            {"field": "device.generic_name.exact", "label": "器械"},
+            {"field": "event_type.exact", "label": "事件类型"},
+        ],
+        "watch": [
+            "device.brand_name",
+            "device.generic_name",
+            "device.manufacturer_d_name",
+        ],
+        "link": "https://open.fda.gov/apis/device/event/explore/?search=mdr_report_key:{id}",
+        "search_link": "https://open.fda.gov/apis/device/event/explore/?search=device.brand_name:{query}",
+    },
+    "food_enforcement": {
+        "name": "食品召回",
+        "emoji": "🥫",
+        "date_field": "report_date",
+        "id_field": "recall_number",
+        "title": {"path": "product_description", "default": "未知产品", "width": 80},
+        "fields": RECALL_FIELDS,
+        "archive": RECALL_ARCHIVE,
+        "count_fields": RECALL_COUNT_FIELDS,
+        "watch": ["product_description", "recalling_firm"],
+        "link": "https://open.fda.gov/apis/food/enforcement/explore/?search=recall_number:{id}",
+        "search_link": "https://open.fda.gov/apis/food/enforcement/explore/?search=product_description:{query}",
+        "search_width": 50,
+    },
+}
+
+# 每条关注列表查询条件的长度上限，超过时拆成多条查询
+WATCHLIST_SEARCH_MAX_CHARS = 2000
+
+# 安全信号基于哪个端点的归档计算，该端点归档有更新时 run_cycle 检测信号
+SIGNAL_ENDPOINT = "drugs"
+
+# 流式读取响应体的块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 飞书消息中标题行和 JSON 结构预留的字节数，以及飞书返回业务错误码时的重试次数
+FEISHU_HEADER_RESERVE = 512
+FEISHU_SEND_RETRIES = 3
+
+# 要获取的数据类型 - 先获取容易成功的
+REPORT_TYPES = [
+    ("label", "药品标签"),
+    ("drugs", "药品不良事件"),
+    ("enforcement", "警告信"),
+    ("drugsfda", "药品审批"),
+    ("device_enforcement", "器械召回"),
+    ("device_event", "器械不良事件"),
+    ("food_enforcement", "食品召回"),
+]
+
+# 守护模式下各端点的默认轮询间隔（秒），可通过 FDA_POLL_<端点> 环境变量覆盖
+DEFAULT_POLL_INTERVALS = {
+    "enforcement": 15 * 60,
+    "drugs": 60 * 60,
+    "label": 24 * 60 * 60,
+    "drugsfda": 24 * 60 * 60,
+    "device_enforcement": 15 * 60,
+    "device_event": 60 * 60,
+    "food_enforcement": 15 * 60,
+}
+
+# OpenFDA 速率限制：每分钟 240 次请求（无 API Key）
+OPENFDA_RATE_LIMIT = 240
+
+# 摄取流水线（获取 → 去重 → 格式化 → 发送）各阶段的默认工作线程数。获取阶段主要在
+# 等待网络，总速率由 openfda_limiter 限制；去重写 SQLite，单线程即可；格式化是纯 CPU
+# 计算；发送阶段每个任务内部已由 SenderPool 按目的地并发
+DEFAULT_PIPELINE_WORKERS = {"fetch": 4, "dedupe": 1, "format": 1, "deliver": 2}
+
+# 流水线相邻阶段之间队列的容量，队列满时上游阶段等待（背压）；获取阶段按批次把记录
+# 交给去重阶段，在途记录数不超过 (队列容量 + 线程数) × 批次大小
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_BATCH_SIZE = 500
+
+# HTTP 连接池中每个主机保留的连接数（多个飞书群的 Webhook 在同一主机上并发发送）
+HTTP_POOL_MAXSIZE = 32
+
+# 没有目的地配置文件时，FEISHU_WEBHOOK 对应的目的地名称
+DEFAULT_DESTINATION = "feishu"
+
+# 目的地熔断：连续失败多少次后断开，断开多少秒后放行一次试探请求
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 300
+
+
+class Config:
+    """运行配置 - 从环境变量读取，命令行参数可以再覆盖其中的值
+
+    导入模块时不读取环境变量，首次调用 get_config() 时才创建；作为库使用时可以
+    构造 Config(env) 并通过 configure() 传入。
+    """
+
+    def __init__(self, env=None):
+        env = os.environ if env is None else env
+
+        # 飞书 Webhook URL（必须配置）
+        self.feishu_webhook = env.get("FEISHU_WEBHOOK")
+
+        # 获取最近多少天的数据，以及每个端点最多获取多少条（0 表示获取整个窗口，
+        # 推送的条数由去重和 max_push_records 限制）
+        self.fetch_days = int(env.get("FDA_FETCH_DAYS", "7"))
+        self.fetch_limit = int(env.get("FDA_FETCH_LIMIT", "0")) or None
+
+        # 本地状态目录（去重索引、归档、缓存），GitHub Actions 中通过 actions/cache 持久化；
+        # 日志和运行报告目录
+        self.data_dir = Path(env.get("FDA_DATA_DIR", "data"))
+        self.log_dir = Path(env.get("FDA_LOG_DIR", "logs"))
+
+        # 已推送记录在去重索引中保留的天数；药品标签的版本记录单独保留更久，
+        # 标签往往相隔数月甚至数年才修订，过早清理会丢失比较基准
+        self.seen_ttl_days = int(env.get("FDA_SEEN_TTL_DAYS", "90"))
+        self.version_ttl_days = int(env.get("FDA_VERSION_TTL_DAYS", "3650"))
+
+        # 关注列表文件（每行一个药品名、企业名或 NDC，# 开头为注释），文件不存在时推送全部记录
+        self.watchlist_file = Path(env.get("FDA_WATCHLIST", "watchlist.txt"))
+
+        # 数据摘要中每个统计字段显示的前 N 项，以及守护模式每天发送摘要的时刻（本地时间，
+        # 小于 0 表示不发送）
+        self.digest_top_n = int(env.get("FDA_DIGEST_TOP_N", "5"))
+        self.digest_hour = int(env.get("FDA_DIGEST_HOUR", "9"))
+
+        # 安全信号检测：统计窗口（天）、最少报告数，以及 PRR 和卡方阈值（Evans 标准）
+        self.signal_days = int(env.get("FDA_SIGNAL_DAYS", "90"))
+        self.signal_min_count = int(env.get("FDA_SIGNAL_MIN_COUNT", "3"))
+        self.signal_prr_threshold = float(env.get("FDA_SIGNAL_PRR", "2.0"))
+        self.signal_chi2_threshold = float(env.get("FDA_SIGNAL_CHI2", "4.0"))
+
+        # OpenFDA 响应缓存：有效期（秒）、磁盘占用上限和单个响应的大小上限（MB），
+        # 有效期设为 0 时每次都重新验证
+        self.cache_ttl = int(env.get("FDA_CACHE_TTL", "3600"))
+        self.cache_max_mb = int(env.get("FDA_CACHE_MAX_MB", "200"))
+        self.cache_max_entry_mb = int(env.get("FDA_CACHE_MAX_ENTRY_MB", "16"))
+
+        # 离线模式：只使用本地缓存的 OpenFDA 响应，不访问网络（也可通过 --offline 开启）
+        self.offline = env.get("FDA_OFFLINE", "").lower() in ("1", "true", "yes")
+
+        # 飞书消息大小上限（字节，自定义机器人请求体上限为 20KB），以及发送速率
+        # （每分钟，自定义机器人限制为 100 次/分钟、5 次/秒）
+        self.feishu_max_message_bytes = int(
+            env.get("FEISHU_MAX_MESSAGE_BYTES", "18000")
+        )
+        self.feishu_rate_limit = int(env.get("FEISHU_RATE_LIMIT", "100"))
+
+        # 推送目的地配置文件（JSON），文件不存在时只推送到 FEISHU_WEBHOOK
+        self.destinations_file = Path(env.get("FDA_DESTINATIONS", "destinations.json"))
+
+        # 每个报告类型最多推送的记录数
+        self.max_push_records = int(env.get("FDA_MAX_PUSH_RECORDS", "100"))
+
+        # outbox 中一条投递最多尝试的次数，超过后标记为 dead，不再补发
+        self.outbox_max_attempts = int(env.get("FDA_OUTBOX_MAX_ATTEMPTS", "10"))
+
+        # 守护模式下各端点的轮询间隔（秒），以及 Prometheus 指标的监听端口（0 表示不开启）
+        self.poll_intervals = {
+            endpoint_type: int(env.get(f"FDA_POLL_{endpoint_type.upper()}", default))
+            for endpoint_type, default in DEFAULT_POLL_INTERVALS.items()
+        }
+        self.metrics_port = int(env.get("FDA_METRICS_PORT", "0"))
+
+        # 摄取流水线各阶段的工作线程数（FDA_WORKERS_<阶段>），以及阶段之间队列的容量
+        self.pipeline_workers = {
+            stage: max(1, int(env.get(f"FDA_WORKERS_{stage.upper()}", default)))
+            for stage, default in DEFAULT_PIPELINE_WORKERS.items()
+        }
+        self.pipeline_queue_size = int(
+            env.get("FDA_PIPELINE_QUEUE_SIZE", str(PIPELINE_QUEUE_SIZE))
+        )
+
+    @property
+    def state_db(self):
+        return self.data_dir / "fda_state.db"
+
+    @property
+    def archive_db(self):
+        return self.data_dir / "fda_archive.db"
+
+    @property
+    def cache_db(self):
+        return self.data_dir / "http_cache.db"
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """获取当前配置（首次使用时从环境变量读取）"""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config()
+    return _config
+
+
+def configure(config):
+    """替换当前配置，并丢弃按旧配置创建的推送目的地、响应缓存和关注列表"""
+    global _config, _sinks, _watchlist
+    with _config_lock:
+        _config = config
+    _sinks = None
+    _watchlist = None
+    close_response_cache()
+    return config
+
+
+class DailyFileHandler(logging.FileHandler):
+    """写入 log_dir 下按日期命名的 fda_YYYYMMDD.log，日期变化后切换到新一天的文件
+
+    serve 常驻进程跨过午夜后，之后的日志写入当天的文件，而不是启动那天的文件。
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = Path(log_dir)
+        self.day = datetime.now().strftime("%Y%m%d")
+        super().__init__(self._path(self.day), encoding="utf-8", delay=True)
+
+    def _path(self, day):
+        return self.log_dir / f"fda_{day}.log"
 
-def get_recent_fda_data(endpoint_type, days=7):
-    """获取最近几天的 FDA 数据"""
+    def emit(self, record):
+        # handle() 已持有处理器的锁
+        day = datetime.fromtimestamp(record.created).strftime("%Y%m%d")
+        if day != self.day:
+            self.day = day
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = os.path.abspath(self._path(day))
+        super().emit(record)
+
+
+def setup_logging():
+    """配置日志：输出到标准错误和 logs/ 下按日期命名的文件，重复调用时不会重复添加"""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    log_dir = get_config().log_dir
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[DailyFileHandler(log_dir), logging.StreamHandler()],
+    )
+
+
+class TokenBucket:
+    """令牌桶限流器 - 线程安全，按固定速率补充令牌"""
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = rate / per  # 每秒补充的令牌数
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Metrics:
+    """运行指标 - 线程安全的计数器、耗时统计和瞬时值，按名称和标签聚合
+
+    计数器和耗时在进程内累计，可以导出为 JSON 运行报告或 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """计数器加 value"""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """记录一次耗时（秒）"""
+        key = self._key(name, labels)
+        with self.lock:
+            count, total, peak = self.timings.get(key, (0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, max(peak, seconds))
+
+    def set(self, name, value, **labels):
+        """设置瞬时值"""
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """统计 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """导出全部指标，按名称分组：{"counters": ..., "timings": ..., "gauges": ...}
+
+        另外附带 stages：每个耗时指标在所有标签上的总耗时，便于查看时间花在哪里。
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            timings = dict(self.timings)
+            gauges = dict(self.gauges)
+
+        report = {"counters": {}, "timings": {}, "gauges": {}, "stages": {}}
+        for (name, labels), value in sorted(counters.items()):
+            report["counters"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        for (name, labels), (count, total, peak) in sorted(timings.items()):
+            report["timings"].setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "max": round(peak, 6),
+                }
+            )
+            report["stages"][name] = round(report["stages"].get(name, 0.0) + total, 6)
+        for (name, labels), value in sorted(gauges.items()):
+            report["gauges"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        return report
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式，耗时指标以 summary 的 _sum / _count 表示"""
+
+        def series(name, labels, value):
+            if labels:
+                text = ",".join(
+                    '{}="{}"'.format(
+                        key,
+                        str(label)
+                        .replace("\\", "\\\\")
+                        .replace('"', '\\"')
+                        .replace("\n", "\\n"),
+                    )
+                    for key, label in labels
+                )
+                return f"{name}{{{text}}} {value}"
+            return f"{name} {value}"
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timings = sorted(self.timings.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(series(name, labels, value))
+        for (name, labels), (count, total, _) in timings:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} summary")
+            lines.append(series(f"{name}_sum", labels, total))
+            lines.append(series(f"{name}_count", labels, count))
+        for (name, labels), value in gauges:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(series(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的运行指标
+metrics = Metrics()
+
+
+def write_run_report(report, path=None):
+    """把运行报告（含指标快照）写入 logs/ 下的 JSON 文件，与日志文件放在一起"""
+    if path is None:
+        log_dir = get_config().log_dir
+        log_dir.mkdir(parents=True, exist_ok=True)
+        path = log_dir / f"fda_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    report = {**report, "metrics": metrics.snapshot()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"运行报告已写入 {path}")
+    return path
+
+
+def start_metrics_server(port):
+    """在后台线程中启动 Prometheus 指标接口（GET /metrics），返回 HTTP 服务对象"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Prometheus 指标接口: http://0.0.0.0:{server.server_port}/metrics")
+    return server
+
+
+# 所有 OpenFDA 请求共享同一个限流器，飞书消息按目的地各自限流（见 FeishuSink）
+openfda_limiter = TokenBucket(OPENFDA_RATE_LIMIT)
+
+
+# HTTP 重试配置 - 指数退避，上限 HTTP_BACKOFF_MAX 秒
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 1.0
+HTTP_BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 非幂等请求（POST）只在服务端明确没有处理请求时重试：读取超时或 502/504 时对方可能
+# 已经收到并处理了消息，重试会导致重复推送
+POST_RETRY_STATUS_CODES = {429, 503}
+
+# 按主机设置请求超时（秒），未列出的主机使用 DEFAULT_TIMEOUT
+HOST_TIMEOUTS = {"api.fda.gov": 30}
+DEFAULT_TIMEOUT = 10
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """获取共享的 HTTP 会话 - 连接池复用 keep-alive 连接"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def close_http_session():
+    """关闭共享的 HTTP 会话"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+
+def _retry_after_seconds(response):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），无法解析时返回 None"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
     try:
-        endpoint = OPENFDA_ENDPOINTS.get(endpoint_type)
-        if not endpoint:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_connect_failure(error):
+    """请求是否在建立连接时就失败了（请求体一定没有发出）
+
+    requests 把连接重置、读取中断等发送后的错误也包装为 ConnectionError，
+    只有连接超时，以及底层原因是 urllib3 NewConnectionError（含 DNS 解析失败）的才算。
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+def http_request(method, url, limiter=None, **kwargs):
+    """发送 HTTP 请求 - 共享连接池，遇到超时、429 和 5xx 时指数退避重试
+
+    POST 只在连接没有建立（见 _is_connect_failure）和 POST_RETRY_STATUS_CODES 时重试，
+    避免请求体已经发出后重复提交。
+    """
+    import requests
+
+    host = urlparse(url).hostname
+    post = method.upper() == "POST"
+    retry_status_codes = POST_RETRY_STATUS_CODES if post else RETRY_STATUS_CODES
+    kwargs.setdefault("timeout", HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUT))
+    session = get_http_session()
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2**attempt)
+        if limiter:
+            limiter.acquire()
+        try:
+            with metrics.timer("fda_http_request_seconds", host=host):
+                response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.inc("fda_http_errors_total", host=host, error=type(e).__name__)
+            if attempt >= HTTP_MAX_RETRIES or (post and not _is_connect_failure(e)):
+                raise
+            logger.warning(
+                f"请求 {host} 失败: {str(e)}，{delay:.1f} 秒后重试 "
+                f"({attempt + 1}/{HTTP_MAX_RETRIES})"
+            )
+        else:
+            if (
+                response.status_code not in retry_status_codes
+                or attempt >= HTTP_MAX_RETRIES
+            ):
+                return response
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None:
+                delay = min(HTTP_BACKOFF_MAX, retry_after)
+            logger.warning(
+                f"请求 {host} 返回 {response.status_code}，{delay:.1f} 秒后重试 "
+                f"({attempt + 1}/{HTTP_MAX_RETRIES})"
+            )
+            response.close()
+        metrics.inc("fda_http_retries_total", host=host)
+        time.sleep(delay)
+
+
+def build_date_search(endpoint_type, days):
+    """构建 OpenFDA 日期范围查询，如 receivedate:[20240101 TO 20240107]"""
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    field = RECORD_SPECS[endpoint_type]["date_field"]
+    return f"{field}:[{start_date.strftime('%Y%m%d')} TO {end_date.strftime('%Y%m%d')}]"
+
+
+def build_watch_searches(endpoint_type, terms):
+    """把关注列表转换为若干条 OpenFDA 查询条件，如 (openfda.brand_name:"ADVIL" ...)
+
+    每条条件内部用空格连接表示 OR，长度不超过 WATCHLIST_SEARCH_MAX_CHARS；
+    关注词较多时按顺序拆成多条，分别查询。同一关注词在各字段上的条件放在同一条里。
+    端点没有配置 watch 字段，或单个关注词的条件就超过上限时返回空列表，此时只在本地匹配。
+    """
+    paths = RECORD_SPECS[endpoint_type].get("watch")
+    if not paths or not terms:
+        return []
+    # 引号和反斜杠会破坏短语查询，直接去掉
+    phrases = [term.replace('"', " ").replace("\\", " ").strip() for term in terms]
+    searches = []
+    clauses = []
+    for phrase in filter(None, phrases):
+        group = [f'{path}:"{phrase}"' for path in paths]
+        if len(f"({' '.join(group)})") > WATCHLIST_SEARCH_MAX_CHARS:
+            return []
+        if clauses and len(f"({' '.join(clauses + group)})") > WATCHLIST_SEARCH_MAX_CHARS:
+            searches.append(f"({' '.join(clauses)})")
+            clauses = []
+        clauses.extend(group)
+    if clauses:
+        searches.append(f"({' '.join(clauses)})")
+    return searches
+
+
+def iter_json_results(chunks, top):
+    """流式解析 OpenFDA 响应体 - 逐条产出 results 数组中的记录
+
+    chunks 为字节块迭代器。只有当前记录会被完整解码，其余顶层字段（如 meta）
+    解码后写入 top 字典。OpenFDA 的 meta 位于 results 之前，因此产出第一条记录时
+    top["meta"] 已经可用。
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+
+    def fill():
+        # 读取更多数据，直到未解析部分至少翻倍，避免大记录被反复重新解析
+        nonlocal buf, pos
+        pending = len(buf) - pos
+        text = [buf[pos:]]
+        added = 0
+        for chunk in chunks:
+            text.append(utf8.decode(chunk))
+            added += len(text[-1])
+            if added > pending:
+                break
+        else:
+            text.append(utf8.decode(b"", final=True))
+            added += len(text[-1])
+        buf = "".join(text)
+        pos = 0
+        return added > 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                raise ValueError("响应体不完整，JSON 提前结束")
+
+    def expect(chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars:
+            raise ValueError(f"JSON 格式错误: 期望 {chars!r}，实际为 {char!r}")
+        pos += 1
+        return char
+
+    def decode_value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # 数字可能恰好在块边界被截断
+            if end == len(buf) and fill():
+                continue
+            pos = end
+            return value
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = decode_value()
+        expect(":")
+        if key == "results" and peek() == "[":
+            pos += 1
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield decode_value()
+                    if expect(",]") == "]":
+                        break
+        else:
+            top[key] = decode_value()
+        if expect(",}") == "}":
+            return
+
+
+def _endpoint_label(url):
+    """指标中使用的端点标签 - 按 URL 路径对应到端点类型"""
+    path = urlparse(url).path
+    for endpoint_type, endpoint in OPENFDA_ENDPOINTS.items():
+        if urlparse(endpoint).path == path:
+            return endpoint_type
+    return path
+
+
+def _measure_parse(items, endpoint, download):
+    """逐条转发解析出的记录，结束时记录解析耗时（扣除等待下载的时间）和记录数
+
+    download 为单元素列表，由下载方累加等待网络数据的秒数。
+    """
+    elapsed = 0.0
+    count = 0
+    items = iter(items)
+    try:
+        while True:
+            start = time.perf_counter()
+            item = next(items, None)
+            elapsed += time.perf_counter() - start
+            if item is None:
+                break
+            count += 1
+            yield item
+    finally:
+        # 调用方提前停止迭代时也记录已解析的部分
+        metrics.observe(
+            "fda_parse_seconds", max(0.0, elapsed - download[0]), endpoint=endpoint
+        )
+        metrics.inc("fda_records_parsed_total", count, endpoint=endpoint)
+
+
+def _stream_response(response, cache, key, next_url, top, stable_key=None):
+    """边下载边解析响应体，完整读取且大小未超过上限时写入缓存"""
+    buffer = bytearray()
+    cacheable = True
+    endpoint = _endpoint_label(response.url)
+    download = [0.0]
+    received = 0
+
+    def chunks():
+        nonlocal cacheable, received
+        content = response.iter_content(STREAM_CHUNK_SIZE)
+        while True:
+            start = time.perf_counter()
+            chunk = next(content, None)
+            download[0] += time.perf_counter() - start
+            if chunk is None:
+                break
+            received += len(chunk)
+            if cacheable:
+                if len(buffer) + len(chunk) <= cache.max_entry_bytes:
+                    buffer.extend(chunk)
+                else:
+                    cacheable = False
+                    buffer.clear()
+            yield chunk
+
+    try:
+        yield from _measure_parse(iter_json_results(chunks(), top), endpoint, download)
+        if cacheable:
+            cache.put(
+                key,
+                status=response.status_code,
+                body=bytes(buffer),
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                next_url=next_url,
+                stable_key=stable_key,
+            )
+    finally:
+        response.close()
+        metrics.inc("fda_download_bytes_total", received, endpoint=endpoint)
+        metrics.observe("fda_download_seconds", download[0], endpoint=endpoint)
+
+
+def _iter_cached_body(entry, top, endpoint=None):
+    """解析缓存中的响应体 - 404 表示没有匹配记录"""
+    if entry["status"] == 404:
+        top["meta"] = {"results": {"total": 0}}
+        return iter(())
+    return _measure_parse(iter_json_results([entry["body"]], top), endpoint, [0.0])
+
+
+def _request_openfda_page(url, params, top):
+    """请求一页 OpenFDA 数据（经过本地缓存），返回 (记录迭代器, 下一页链接)
+
+    记录在迭代时才逐条解析，页面的 meta 等顶层字段在迭代开始后写入 top。
+    """
+    cache = get_response_cache()
+    key = cache.make_key(url, params)
+    stable_key = cache.make_stable_key(url, params)
+    entry = cache.get(key)
+    endpoint = _endpoint_label(url)
+
+    offline = get_config().offline
+    if offline and not entry:
+        # 日期窗口随运行日期变化，离线时使用最近一次缓存的同类查询
+        entry = cache.get_latest(stable_key)
+    if entry and (offline or cache.is_fresh(entry)):
+        logger.info(f"使用缓存的响应: {url}")
+        metrics.inc("fda_cache_requests_total", endpoint=endpoint, result="hit")
+        return _iter_cached_body(entry, top, endpoint), entry["next_url"]
+    if offline:
+        metrics.inc("fda_cache_requests_total", endpoint=endpoint, result="miss")
+        raise RuntimeError(f"离线模式下没有找到缓存的响应: {url} {params or ''}")
+
+    # 缓存过期时发送条件请求，未变化的页面只返回 304
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = http_request(
+        "GET",
+        url,
+        params=params,
+        headers=headers,
+        stream=True,
+        limiter=openfda_limiter,
+    )
+    if response.status_code == 304 and entry:
+        response.close()
+        logger.info(f"响应未变化（304），使用缓存: {url}")
+        metrics.inc("fda_cache_requests_total", endpoint=endpoint, result="revalidated")
+        cache.refresh(key)
+        return _iter_cached_body(entry, top, endpoint), entry["next_url"]
+    metrics.inc("fda_cache_requests_total", endpoint=endpoint, result="miss")
+    if response.status_code == 404:
+        # OpenFDA 在没有匹配记录时返回 404
+        response.close()
+        cache.put(key, status=404, body=b"", stable_key=stable_key)
+        return _iter_cached_body({"status": 404}, top), None
+    if response.status_code >= 400:
+        response.close()
+    response.raise_for_status()
+
+    next_url = response.links.get("next", {}).get("url")
+    return (
+        _stream_response(response, cache, key, next_url, top, stable_key),
+        next_url,
+    )
+
+
+def iter_fda_records(
+    endpoint_type,
+    days=7,
+    page_size=PAGE_SIZE,
+    max_records=None,
+    meta=None,
+    project=True,
+    search=None,
+):
+    """按日期窗口分页获取 FDA 记录 - 生成器，逐条产出，内存占用与窗口大小无关
+
+    优先跟随响应 Link 头中的 search_after 游标翻页，没有游标时使用 skip 分页。
+    响应体流式解析，project=True 时每条记录只保留提取器需要的顶层字段。
+    传入 meta 字典时会写入第一页的 meta 信息（包含窗口内的记录总数）。
+    search 为附加的查询条件，与日期窗口用 AND 组合。
+    """
+    endpoint = OPENFDA_ENDPOINTS.get(endpoint_type)
+    if not endpoint:
+        raise ValueError(f"未知的端点类型: {endpoint_type}")
+
+    extractor = EXTRACTORS[endpoint_type] if project else None
+    date_field = RECORD_SPECS[endpoint_type]["date_field"]
+    date_search = build_date_search(endpoint_type, days)
+    params = {
+        "search": f"{date_search} AND {search}" if search else date_search,
+        "sort": f"{date_field}:desc",
+        "limit": page_size,
+    }
+    url = endpoint
+    fetched = 0
+    skip = 0
+
+    while True:
+        if params is not None and max_records is not None:
+            params["limit"] = min(page_size, max_records - fetched)
+        logger.info(f"正在请求 {endpoint_type} 数据，参数: {params or url}")
+        top = {}
+        items, next_url = _request_openfda_page(url, params, top)
+
+        page_count = 0
+        for item in items:
+            if extractor:
+                item = extractor.project(item)
+            yield item
+            page_count += 1
+        fetched += page_count
+
+        page_meta = top.get("meta", {})
+        if meta is not None and not meta:
+            meta.update(page_meta)
+
+        if not page_count or (max_records is not None and fetched >= max_records):
+            return
+        if next_url:
+            # 游标链接已包含完整的查询参数
+            url, params = next_url, None
+        elif params is not None:
+            skip += page_count
+            total = page_meta.get("results", {}).get("total", 0)
+            if skip >= total or skip > MAX_SKIP:
+                if skip < total:
+                    logger.warning(
+                        f"{endpoint_type} 窗口内共 {total} 条记录，超过分页上限，仅获取前 {skip} 条"
+                    )
+                return
+            params["skip"] = skip
+        else:
+            return
+
+
+def iter_recent_fda_records(endpoint_type, days=7, limit=None, meta=None):
+    """按日期降序逐条产出最近几天的 FDA 记录，最多 limit 条（None 表示整个窗口）
+
+    配置了关注列表时只产出匹配的记录：关注词转换为一条或多条 search= 条件由服务端过滤，
+    并且总会在本地再匹配一次；无法转换时在本地匹配整个窗口。
+    """
+    watchlist = get_watchlist()
+    if watchlist is None:
+        return iter_fda_records(endpoint_type, days=days, max_records=limit, meta=meta)
+    return _iter_watched_records(endpoint_type, watchlist, days, limit, meta)
+
+
+def get_recent_fda_data(endpoint_type, days=7, limit=None):
+    """获取最近几天的 FDA 数据 - 按日期降序，最多 limit 条（None 表示整个窗口）
+
+    全部记录会载入内存，只用于需要完整列表的场合（如 fetch 阶段输出 JSON）；
+    摄取流水线按批次流式处理，见 fetch_job。
+    """
+    import requests
+
+    try:
+        if endpoint_type not in OPENFDA_ENDPOINTS:
             logger.error(f"未知的端点类型: {endpoint_type}")
             return None
 
-        # 计算日期范围
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-
-        # 构建查询参数 - 按日期排序获取最新数据
-        params = {"limit": 10}
-
-        # 根据不同类型设置排序和过滤
-        if endpoint_type == "enforcement":
-            # enforcement 按 report_date 降序排序
-            params["sort"] = "report_date:desc"
-            params["limit"] = 10
-        elif endpoint_type == "drugs":
-            # drug event 按 receivedate 降序排序
-            params["sort"] = "receivedate:desc"
-            params["limit"] = 10
-        elif endpoint_type == "label":
-            # label 按 effective_time 降序排序
-            params["sort"] = "effective_time:desc"
-            params["limit"] = 10
-
-        logger.info(f"正在请求 {endpoint_type} 数据，参数: {params}")
-        response = requests.get(endpoint, params=params, timeout=30)
-        response.raise_for_status()
-
-        data = response.json()
+        meta = {}
+        with metrics.timer("fda_fetch_seconds", endpoint=endpoint_type):
+            results = list(iter_recent_fda_records(endpoint_type, days, limit, meta))
+        metrics.inc("fda_records_fetched_total", len(results), endpoint=endpoint_type)
+        data = {"meta": meta, "results": results}
+        total = meta.get("results", {}).get("total", len(results))
         logger.info(
-            f"成功获取 {endpoint_type} 数据，共 {len(data.get('results', []))} 条记录"
+            f"成功获取 {endpoint_type} 数据，共 {len(results)} 条记录（最近 {days} 天共 {total} 条）"
         )
         return data
     except requests.exceptions.Timeout:
@@ -79,342 +1242,1936 @@ def get_recent_fda_data(endpoint_type, days=7):
         return None
 
 
-def format_message(data, report_type):
-    """格式化消息内容 - 参考 trendrader 风格"""
-    try:
-        if not data or "results" not in data:
-            logger.warning(f"{report_type} 数据为空或格式不正确")
-            return None
+def _iter_watched_records(endpoint_type, watchlist, days, limit, meta):
+    """逐条产出最多 limit 条匹配关注列表的记录"""
+    searches = build_watch_searches(endpoint_type, watchlist.terms)
+    if searches:
+        # 服务端已过滤，本地匹配只用于剔除分词造成的误匹配
+        records = _iter_search_results(endpoint_type, searches, days, limit, meta)
+    else:
+        logger.info(f"{endpoint_type} 关注列表无法转换为查询条件，改为在本地匹配整个窗口")
+        records = iter_fda_records(endpoint_type, days=days, meta=meta)
+
+    matches = EXTRACTORS[endpoint_type].watch_matches
+    matched = 0
+    scanned = 0
+    for item in records:
+        scanned += 1
+        if matches(watchlist, item):
+            yield item
+            matched += 1
+            if limit and matched >= limit:
+                break
+    logger.info(f"{endpoint_type} 关注列表匹配 {matched} 条（扫描 {scanned} 条）")
+
+
+def _iter_search_results(endpoint_type, searches, days, limit, meta):
+    """依次执行每条关注列表查询，按记录 ID 去掉在多条查询中重复出现的记录
+
+    meta 取第一条查询的 meta，窗口总数为各条查询之和（可能包含重复记录）。
+    """
+    get_id = EXTRACTORS[endpoint_type].get_id
+    seen = set()
+    total = 0
+    for search in searches:
+        page_meta = {}
+        records = iter_fda_records(
+            endpoint_type,
+            days=days,
+            page_size=max(limit, 100) if limit else PAGE_SIZE,
+            meta=page_meta,
+            search=search,
+        )
+        for item in records:
+            record_id = get_id(item)
+            if record_id is not None:
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+            yield item
+        total += page_meta.get("results", {}).get("total", 0)
+        if meta is not None:
+            if not meta:
+                meta.update(page_meta)
+            meta.setdefault("results", {})["total"] = total
+
+
+def query_openfda(endpoint_type, params):
+    """执行一次单页 OpenFDA 查询，返回 (meta, results)"""
+    top = {}
+    items, _ = _request_openfda_page(OPENFDA_ENDPOINTS[endpoint_type], params, top)
+    results = list(items)
+    return top.get("meta", {}), results
+
+
+def get_fda_total(endpoint_type, days=7):
+    """获取日期窗口内的记录总数 - 只请求 1 条记录，读取 meta.results.total"""
+    meta, _ = query_openfda(
+        endpoint_type, {"search": build_date_search(endpoint_type, days), "limit": 1}
+    )
+    return meta.get("results", {}).get("total", 0)
+
+
+def get_fda_counts(endpoint_type, field, days=7, limit=None):
+    """用 count= 查询统计日期窗口内某个字段的取值分布，返回 [(取值, 记录数)]"""
+    if limit is None:
+        limit = get_config().digest_top_n
+    _, results = query_openfda(
+        endpoint_type,
+        {
+            "search": build_date_search(endpoint_type, days),
+            "count": field,
+            "limit": limit,
+        },
+    )
+    return [(row.get("term"), row.get("count", 0)) for row in results]
+
+
+def get_result_total(data):
+    """数据中的记录总数 - 优先使用 meta.results.total（服务端统计的窗口总数）"""
+    total = data.get("meta", {}).get("results", {}).get("total")
+    return total if total is not None else len(data.get("results", []))
+
+
+def fetch_all_fda_data(report_types, days=None, limit=None):
+    """并发获取多个端点的 FDA 数据，返回 {endpoint_type: data 或异常}
+
+    days 和 limit 默认使用配置中的 fetch_days 和 fetch_limit。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    config = get_config()
+    days = config.fetch_days if days is None else days
+    limit = config.fetch_limit if limit is None else limit
+    results = {}
+    with ThreadPoolExecutor(max_workers=config.pipeline_workers["fetch"]) as executor:
+        futures = {
+            endpoint_type: executor.submit(
+                get_recent_fda_data, endpoint_type, days, limit
+            )
+            for endpoint_type, _ in report_types
+        }
+        for endpoint_type, future in futures.items():
+            try:
+                results[endpoint_type] = future.result()
+            except Exception as e:
+                results[endpoint_type] = e
+    return results
+
+
+def open_state_db(path=None):
+    """打开本地状态数据库（SQLite，WAL 模式支持多线程读写）"""
+    path = Path(path or get_config().state_db)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def get_record_id(endpoint_type, item):
+    """获取记录的唯一标识，没有标识字段时返回空字符串"""
+    spec = RECORD_SPECS.get(endpoint_type)
+    return str(item.get(spec["id_field"]) or "") if spec else ""
+
+
+class SeenStore:
+    """已推送记录索引 - SQLite 主键查找，无需把全部 ID 载入内存
+
+    配置了 version_field 的端点（药品标签）同时记录每条记录推送时的版本号和章节哈希，
+    同一 ID 的新版本会再次推送，并附带章节级的变更说明。
+    """
+
+    # 单条 SQL 中 IN 子句的最大参数数
+    BATCH_SIZE = 500
+
+    def __init__(self, path=None, ttl_days=None, version_ttl_days=None):
+        config = get_config()
+        self.ttl_days = config.seen_ttl_days if ttl_days is None else ttl_days
+        self.version_ttl_days = (
+            config.version_ttl_days if version_ttl_days is None else version_ttl_days
+        )
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen_records (
+                endpoint TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, record_id)
+            ) WITHOUT ROWID
+            """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS record_versions (
+                endpoint TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                sections TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, record_id)
+            ) WITHOUT ROWID
+            """)
+        self.conn.commit()
+
+    def _select(self, columns, table, endpoint_type, ids):
+        """按 ID 分批查询 table 中的行，返回 (record_id, *columns) 列表"""
+        unique_ids = list({record_id for record_id in ids if record_id})
+        rows = []
+        with self.lock:
+            for i in range(0, len(unique_ids), self.BATCH_SIZE):
+                batch = unique_ids[i : i + self.BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows += self.conn.execute(
+                    f"SELECT record_id{columns} FROM {table} "
+                    f"WHERE endpoint = ? AND record_id IN ({placeholders})",
+                    [endpoint_type, *batch],
+                ).fetchall()
+        return rows
+
+    def filter_new(self, endpoint_type, results):
+        """过滤出未推送过的记录（没有标识字段的记录总是视为新记录）
+
+        有版本的端点返回新记录和有修订的记录，变更说明写入记录的 CHANGES_KEY 字段。
+        """
+        ids = [get_record_id(endpoint_type, item) for item in results]
+        extractor = EXTRACTORS.get(endpoint_type)
+        if extractor and extractor.version_field:
+            return self._filter_changed(extractor, ids, results)
+
+        seen = {row[0] for row in self._select("", "seen_records", endpoint_type, ids)}
+        new_results = []
+        for record_id, item in zip(ids, results):
+            if record_id and record_id in seen:
+                continue
+            if record_id:
+                seen.add(record_id)  # 同一批次内也去重
+            new_results.append(item)
+        return new_results
+
+    def _filter_changed(self, extractor, ids, results):
+        """按版本号和章节哈希过滤出新记录和有修订的记录，附带变更说明"""
+        endpoint_type = extractor.endpoint_type
+        previous = {
+            record_id: (version, json.loads(sections))
+            for record_id, version, sections in self._select(
+                ", version, sections", "record_versions", endpoint_type, ids
+            )
+        }
+        # 升级前已推送过、还没有版本记录的记录，只记录当前版本作为比较基准，不再推送
+        legacy = {
+            row[0]
+            for row in self._select("", "seen_records", endpoint_type, ids)
+            if row[0] not in previous
+        }
+
+        new_results = []
+        baseline = []
+        handled = set()
+        for record_id, item in zip(ids, results):
+            if record_id in handled:
+                continue  # 同一批次内也去重
+            if record_id:
+                handled.add(record_id)
+            if record_id in legacy:
+                baseline.append(item)
+                continue
+            current = (
+                str(item.get(extractor.version_field) or ""),
+                extractor.section_hashes(item),
+            )
+            changes = extractor.describe_changes(current, previous.get(record_id))
+            if changes:
+                new_results.append({**item, CHANGES_KEY: changes})
+        if baseline:
+            self.mark_seen(endpoint_type, baseline)
+        return new_results
+
+    def mark_seen(self, endpoint_type, results):
+        """记录已推送的记录（有版本的端点同时记录版本号和章节哈希）"""
+        now = time.time()
+        rows = []
+        version_rows = []
+        extractor = EXTRACTORS.get(endpoint_type)
+        version_field = extractor.version_field if extractor else None
+        for item in results:
+            record_id = get_record_id(endpoint_type, item)
+            if not record_id:
+                continue
+            rows.append((endpoint_type, record_id, now))
+            if version_field:
+                sections = json.dumps(extractor.section_hashes(item), sort_keys=True)
+                version = str(item.get(version_field) or "")
+                version_rows.append((endpoint_type, record_id, version, sections, now))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO seen_records VALUES (?, ?, ?)", rows
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO record_versions VALUES (?, ?, ?, ?, ?)",
+                version_rows,
+            )
+            self.conn.commit()
+
+    def purge_expired(self):
+        """清理超过保留期的记录，返回清理条数（版本记录按 version_ttl_days 单独清理）"""
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "DELETE FROM seen_records WHERE seen_at < ?",
+                (now - self.ttl_days * 86400,),
+            )
+            self.conn.execute(
+                "DELETE FROM record_versions WHERE seen_at < ?",
+                (now - self.version_ttl_days * 86400,),
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+class ResponseCache:
+    """OpenFDA 响应磁盘缓存 - 按端点和参数索引，TTL 过期，超过容量时按 LRU 淘汰
+
+    每个条目同时记录一个不含具体日期的稳定键（日期窗口只保留天数），离线模式下
+    找不到当天的条目时，按稳定键使用最近一次缓存的同类查询。
+    """
+
+    # 日期窗口查询条件，如 receivedate:[20240101 TO 20240107]
+    DATE_RANGE = re.compile(r"\[(\d{8}) TO (\d{8})\]")
+
+    def __init__(self, path=None, ttl=None, max_bytes=None, max_entry_bytes=None):
+        """未指定的参数使用配置中的 cache_* 设置"""
+        config = get_config()
+        if max_bytes is None:
+            max_bytes = config.cache_max_mb * 1024**2
+        if max_entry_bytes is None:
+            max_entry_bytes = config.cache_max_entry_mb * 1024**2
+        self.ttl = config.cache_ttl if ttl is None else ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path or config.cache_db)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                next_url TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                stable_key TEXT
+            )
+            """)
+        columns = {
+            row["name"] for row in self.conn.execute("PRAGMA table_info(http_cache)")
+        }
+        if "stable_key" not in columns:
+            self.conn.execute("ALTER TABLE http_cache ADD COLUMN stable_key TEXT")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_accessed ON http_cache (accessed_at)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_http_cache_stable "
+            "ON http_cache (stable_key, fetched_at)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(url, params):
+        """根据 URL 和查询参数生成缓存键"""
+        raw = json.dumps([url, sorted((params or {}).items())], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def make_stable_key(cls, url, params):
+        """生成不含具体日期的缓存键：日期窗口替换为窗口天数，游标链接先解码再替换"""
+
+        def window(match):
+            start, end = (datetime.strptime(value, "%Y%m%d") for value in match.groups())
+            return f"[{(end - start).days}d]"
+
+        raw = json.dumps(
+            [unquote_plus(url), sorted((params or {}).items())], ensure_ascii=False
+        )
+        raw = cls.DATE_RANGE.sub(window, raw)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def get(self, key):
+        """读取缓存条目并更新访问时间，不存在时返回 None"""
+        with self.lock:
+            entry = self.conn.execute(
+                "SELECT * FROM http_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if entry:
+                self.conn.execute(
+                    "UPDATE http_cache SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.conn.commit()
+        return entry
+
+    def get_latest(self, stable_key):
+        """按稳定键读取最近一次写入的缓存条目，不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT key FROM http_cache WHERE stable_key = ? "
+                "ORDER BY fetched_at DESC LIMIT 1",
+                (stable_key,),
+            ).fetchone()
+        return self.get(row["key"]) if row else None
+
+    def put(
+        self,
+        key,
+        status,
+        body,
+        etag=None,
+        last_modified=None,
+        next_url=None,
+        stable_key=None,
+    ):
+        """写入缓存条目，超过容量上限时淘汰最久未访问的条目"""
+        if len(body) > self.max_entry_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO http_cache "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    status,
+                    body,
+                    len(body),
+                    etag,
+                    last_modified,
+                    next_url,
+                    now,
+                    now,
+                    stable_key,
+                ),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def refresh(self, key):
+        """重新验证成功（304）后刷新缓存时间"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE http_cache SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM http_cache"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            "SELECT key, size FROM http_cache ORDER BY accessed_at"
+        ).fetchall()
+        evicted = []
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((row["key"],))
+            total -= row["size"]
+        self.conn.executemany("DELETE FROM http_cache WHERE key = ?", evicted)
+        logger.info(f"响应缓存超过容量上限，已淘汰 {len(evicted)} 个条目")
+
+    def close(self):
+        self.conn.close()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取共享的响应缓存（首次使用时打开）"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
+
+
+def close_response_cache():
+    """关闭共享的响应缓存，下次使用时重新打开"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is not None:
+            _response_cache.close()
+            _response_cache = None
+
+
+def _compile_path(path, default=""):
+    """把点号分隔的字段路径编译为取值函数，任一级缺失或为空时返回默认值"""
+    keys = tuple(int(key) if key.isdigit() else key for key in path.split("."))
+
+    if len(keys) == 1:
+        # 顶层字段是最常见的情况，直接用 dict.get
+        key = keys[0]
+
+        def get(item):
+            return item.get(key) or default
+
+        return get
+
+    def get(item):
+        value = item
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+        return value or default
+
+    return get
+
+
+def _compile_list_path(path):
+    """把 列表路径.字段 编译为取值函数，返回列表中每个元素该字段的去重值（保持顺序）"""
+    list_path, _, field = path.rpartition(".")
+    get_list = _compile_path(list_path, default=[])
+
+    def get(item):
+        values = {}
+        for element in get_list(item):
+            value = element.get(field) if isinstance(element, dict) else None
+            if value:
+                values[str(value).strip().upper()] = None
+        return list(values)
+
+    return get
+
+
+def _compile_values_path(path):
+    """把字段路径编译为取值函数，返回路径上所有值的字符串列表（遇到列表时展开每个元素）"""
+    keys = path.split(".")
+
+    def get(item):
+        values = []
+        stack = [(item, 0)]
+        while stack:
+            value, depth = stack.pop()
+            if isinstance(value, list):
+                stack.extend((element, depth) for element in reversed(value))
+            elif depth == len(keys):
+                if value:
+                    values.append(str(value))
+            elif isinstance(value, dict):
+                stack.append((value.get(keys[depth]), depth + 1))
+        return values
+
+    return get
+
+
+def _compile_latest_path(path, default=""):
+    """把经过列表的字段路径编译为取值函数，返回所有值中最大的一个（YYYYMMDD 日期即最新的）"""
+    get_values = _compile_values_path(path)
+
+    def get(item):
+        return max(get_values(item), default=default)
+
+    return get
+
+
+def _format_date(value):
+    """把 YYYYMMDD 格式化为 YYYY-MM-DD，其他格式原样返回"""
+    if len(value) >= 8:
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+    return value
+
+
+def _compile_field(field):
+    """把字段配置编译为取值函数，返回格式化后的字符串"""
+    compile_path = _compile_latest_path if field.get("latest") else _compile_path
+    get = compile_path(field["path"], field.get("default", ""))
+    width = field.get("width")
+    is_date = field.get("date", False)
+    fmt = field.get("fmt")
+
+    if not (width or is_date or fmt):
+        return lambda item: str(get(item))
+
+    def extract(item):
+        value = str(get(item))
+        if width:
+            value = value[:width]
+        if value and is_date:
+            value = _format_date(value)
+        if value and fmt:
+            value = fmt.format(value)
+        return value
+
+    return extract
+
+
+class RecordExtractor:
+    """按 RECORD_SPECS 配置编译好的记录提取器"""
+
+    def __init__(self, endpoint_type, spec):
+        self.endpoint_type = endpoint_type
+        self.spec = spec
+        self.name = spec["name"]
+        self.emoji = spec.get("emoji", "📊")
+        self.get_id = _compile_path(spec["id_field"])
+        self.get_title = _compile_field(spec["title"])
+        self.fields = [
+            (
+                field["key"],
+                field["label"],
+                field.get("text", True),
+                _compile_field(field),
+            )
+            for field in spec["fields"]
+        ]
+        # (key, label) 列表，分别用于纯文本和富文本渲染
+        self.text_fields = [(key, label) for key, label, text, _ in self.fields if text]
+        self.rich_fields = [(key, label) for key, label, _, _ in self.fields]
+        # 预编译的渲染模板：(key, 字段前缀)，分别用于纯文本、推送消息和富文本
+        self.text_templates = [(key, f"\n   {label}: ") for key, label in self.text_fields]
+        self.message_templates = [
+            (key, f"\n\n   {label}: ") for key, label in self.rich_fields
+        ]
+        self.rich_templates = [(key, f"\n   {label}: ") for key, label in self.rich_fields]
+        self.link = spec["link"]
+        self.search_link = spec["search_link"]
+        self.search_width = spec.get("search_width")
+        self.field_getters = [(key, extract) for key, _, _, extract in self.fields]
+        # 归档用的原始取值函数：不截断、不套用显示模板、不格式化日期、没有默认值
+        self.get_raw_title = _compile_path(spec["title"]["path"], None)
+        self.raw_getters = [
+            (
+                field["key"],
+                (_compile_latest_path if field.get("latest") else _compile_path)(
+                    field["path"], None
+                ),
+            )
+            for field in spec["fields"]
+        ]
+        if spec.get("date_latest"):
+            self.get_date = _compile_latest_path(spec["date_field"])
+        else:
+            self.get_date = _compile_path(spec["date_field"])
+        if "pairs" in spec:
+            self.get_drugs = _compile_list_path(spec["pairs"]["drug"])
+            self.get_reactions = _compile_list_path(spec["pairs"]["reaction"])
+        else:
+            self.get_drugs = self.get_reactions = None
+        self.archive_columns = [
+            (column, _compile_path(path))
+            for column, path in spec.get("archive", {}).items()
+        ]
+        self.watch_getters = [
+            _compile_values_path(path) for path in spec.get("watch", [])
+        ]
+        # 流式解析时只保留这些顶层字段，丢弃标签全文等大字段
+        paths = [spec["id_field"], spec["date_field"], spec["title"]["path"]]
+        paths += [field["path"] for field in spec["fields"]]
+        paths += list(spec.get("archive", {}).values())
+        paths += list(spec.get("pairs", {}).values())
+        paths += spec.get("watch", [])
+        self.version_field = spec.get("version_field")
+        if self.version_field:
+            paths.append(self.version_field)
+        self.sections = spec.get("sections", {})
+        self.keep_keys = {path.split(".")[0] for path in paths} | set(
+            spec.get("keep", [])
+        )
+
+    def project(self, item):
+        """只保留 keep_keys 中的顶层字段，配置了 sections 时各章节替换为内容哈希"""
+        projected = {key: item[key] for key in self.keep_keys if key in item}
+        if self.sections:
+            projected[SECTION_HASHES_KEY] = self.section_hashes(item)
+        return projected
+
+    def section_hashes(self, item):
+        """各章节的内容哈希 {章节字段: 哈希}，记录已经投影过时直接返回保存的哈希"""
+        if SECTION_HASHES_KEY in item:
+            return item[SECTION_HASHES_KEY]
+        hashes = {}
+        for section in self.sections:
+            value = item.get(section)
+            if not value:
+                continue
+            # 章节内容是字符串列表，直接拼接后哈希，避免再序列化一遍
+            text = "\x1f".join(map(str, value)) if isinstance(value, list) else str(value)
+            hashes[section] = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+        return hashes
+
+    def describe_changes(self, current, previous):
+        """比较记录当前的 (版本号, 章节哈希) 与上次推送时的，生成章节级的变更说明
+
+        previous 为 None 表示新记录；版本号和章节内容都没有变化时返回 None。
+        """
+        version, hashes = current
+        if previous is None:
+            return f"新{self.name}（版本 {version}）" if version else f"新{self.name}"
+        old_version, old_hashes = previous
+        changes = {
+            "修改": [
+                section
+                for section, digest in hashes.items()
+                if section in old_hashes and old_hashes[section] != digest
+            ],
+            "新增": [section for section in hashes if section not in old_hashes],
+            "删除": [section for section in old_hashes if section not in hashes],
+        }
+        parts = [
+            f"{action} {'、'.join(self.sections.get(s, s) for s in sections)}"
+            for action, sections in changes.items()
+            if sections
+        ]
+        if not parts and version == old_version:
+            return None
+        if version != old_version:
+            prefix = f"版本 {old_version} → {version}"
+        else:
+            prefix = "内容更新"
+        return f"{prefix}：{'；'.join(parts) or '其他章节修订'}"
+
+    def extract(self, item):
+        """提取一条记录，返回包含 id、title、url 和各字段值的字典"""
+        record_id = str(self.get_id(item))
+        title = self.get_title(item)
+        if record_id:
+            url = self.link.format(id=record_id)
+        else:
+            url = self.search_link.format(query=quote(title[: self.search_width]))
+        record = {"id": record_id, "title": title, "url": url}
+        for key, extract in self.field_getters:
+            record[key] = extract(item)
+        return record
+
+    def normalize(self, item):
+        """提取一条记录的原始字段值（用于归档），返回包含 id、title、url 和各字段值的字典
+
+        与 extract 不同，字段值保持 OpenFDA 中的原样，显示用的截断、模板和日期格式化
+        只在渲染时使用。
+        """
+        record_id = str(self.get_id(item))
+        title = self.get_raw_title(item)
+        if record_id:
+            url = self.link.format(id=record_id)
+        else:
+            query = str(title or "")[: self.search_width]
+            url = self.search_link.format(query=quote(query))
+        record = {"id": record_id, "title": title, "url": url}
+        for key, get in self.raw_getters:
+            record[key] = get(item)
+        return record
+
+    def extract_all(self, results):
+        """批量提取记录"""
+        extract = self.extract
+        return [extract(item) for item in results]
+
+    def render(self, record):
+        """按预编译模板渲染一条提取后的记录，返回不带序号的 (纯文本, 推送文本, 富文本元素)
+
+        推送文本中链接显示为 标题 (URL)，与飞书 Webhook 的纯文本消息格式一致。
+        """
+        title, url = record["title"], record["url"]
+        text = title + "".join(
+            prefix + record[key] for key, prefix in self.text_templates if record[key]
+        )
+        message = (
+            f"{title} ({url})"
+            + "".join(
+                prefix + record[key]
+                for key, prefix in self.message_templates
+                if record[key]
+            )
+            + "\n"
+        )
+        rich = [{"tag": "a", "text": title, "href": url}]
+        rich.extend(
+            {"tag": "text", "text": prefix + record[key]}
+            for key, prefix in self.rich_templates
+            if record[key]
+        )
+        rich.append({"tag": "text", "text": "\n\n"})
+        return text, message, rich
+
+    def watch_text(self, item):
+        """记录中所有关注字段的值，用换行连接为一段文本"""
+        return "\n".join(value for get in self.watch_getters for value in get(item))
+
+    def watch_matches(self, watchlist, item):
+        """记录的关注字段是否包含关注列表中的任一词"""
+        return watchlist.search(self.watch_text(item))
+
+
+# 编译好的提取器，按端点类型和显示名称索引
+EXTRACTORS = {
+    endpoint_type: RecordExtractor(endpoint_type, spec)
+    for endpoint_type, spec in RECORD_SPECS.items()
+}
+EXTRACTORS_BY_NAME = {extractor.name: extractor for extractor in EXTRACTORS.values()}
+
+
+def get_extractor(report_type):
+    """按端点类型或报告显示名称获取提取器"""
+    return EXTRACTORS.get(report_type) or EXTRACTORS_BY_NAME.get(report_type)
+
+
+class WatchlistMatcher:
+    """关注列表匹配器 - Aho-Corasick 自动机
+
+    所有关注词编译为一个自动机，扫描一遍文本即可找出全部命中，耗时与文本长度
+    成线性，与关注词数量无关。匹配不区分大小写，且要求命中位置前后不是字母或数字，
+    避免 ASA 匹配到 NASAL。
+    """
+
+    def __init__(self, terms):
+        self.terms = []
+        # 状态转移表、失败指针，以及每个状态结束的关注词 (序号, 长度)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        seen = set()
+        for term in terms:
+            key = term.strip().casefold()
+            if key and key not in seen:
+                seen.add(key)
+                self._insert(key, len(self.terms))
+                self.terms.append(term.strip())
+        self._build_failure_links()
+
+    def _insert(self, key, index):
+        state = 0
+        for char in key:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] += ((index, len(key)),)
+
+    def _build_failure_links(self):
+        """按层次遍历计算失败指针，并把失败状态的输出合并到当前状态"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] += self.output[self.fail[next_state]]
+                queue.append(next_state)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find(self, text):
+        """逐个产出文本中命中的关注词（原始写法），同一个词可能产出多次"""
+        text = text.casefold()
+        goto, fail, output = self.goto, self.fail, self.output
+        last = len(text) - 1
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index, length in output[state]:
+                start = position - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (
+                    position == last or not text[position + 1].isalnum()
+                ):
+                    yield self.terms[index]
+
+    def search(self, text):
+        """文本是否包含任一关注词"""
+        return next(self.find(text), None) is not None
+
+
+def load_watchlist(path=None):
+    """读取关注列表文件，返回关注词列表（忽略空行和 # 开头的注释）"""
+    with open(path or get_config().watchlist_file, encoding="utf-8") as f:
+        terms = [line.strip() for line in f]
+    return [term for term in terms if term and not term.startswith("#")]
+
+
+_watchlist = None
+_watchlist_lock = threading.Lock()
+
+
+def get_watchlist():
+    """获取共享的关注列表匹配器（首次使用时编译），没有配置关注列表时返回 None"""
+    global _watchlist
+    if _watchlist is None:
+        with _watchlist_lock:
+            if _watchlist is None:
+                path = get_config().watchlist_file
+                terms = load_watchlist(path) if path.exists() else []
+                _watchlist = WatchlistMatcher(terms)
+                if terms:
+                    logger.info(
+                        f"已加载关注列表 {path}，共 {len(_watchlist)} 个关注词"
+                    )
+    return _watchlist if len(_watchlist) else None
+
+
+def _render_results(data, report_type):
+    """校验数据并渲染要显示的记录，没有可显示的数据时返回 (None, None)"""
+    if not data or "results" not in data:
+        logger.warning(f"{report_type} 数据为空或格式不正确")
+        return None, None
+
+    results = data["results"]
+    if len(results) == 0:
+        logger.info(f"{report_type} 没有新数据")
+        return None, None
+
+    extractor = get_extractor(report_type)
+    if not extractor:
+        logger.warning(f"未知的报告类型: {report_type}")
+        return None, None
+
+    return extractor, [
+        extractor.render(extractor.extract(item))
+        for item in results[: get_config().max_push_records]
+    ]
+
+
+class RecordArchive:
+    """本地 FDA 记录归档 - SQLite，按端点+日期、名称和级别建索引，支持本地聚合查询"""
+
+    # query() 支持的分组维度
+    GROUP_BY_COLUMNS = {
+        "endpoint": "endpoint",
+        "date": "record_date",
+        "month": "substr(record_date, 1, 7)",
+        "name": "name",
+        "classification": "classification",
+        "manufacturer": "manufacturer",
+    }
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path or get_config().archive_db)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fda_records (
+                endpoint TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                record_date TEXT,
+                name TEXT COLLATE NOCASE,
+                classification TEXT,
+                manufacturer TEXT COLLATE NOCASE,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, record_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_date
+                ON fda_records (endpoint, record_date);
+            CREATE INDEX IF NOT EXISTS idx_records_name ON fda_records (name);
+            CREATE INDEX IF NOT EXISTS idx_records_classification
+                ON fda_records (endpoint, classification, record_date);
+
+            -- 不良事件报告展开后的药品、反应和药品×反应组合，用于信号检测
+            CREATE TABLE IF NOT EXISTS event_drugs (
+                report_id TEXT NOT NULL,
+                drug TEXT NOT NULL,
+                report_date TEXT,
+                PRIMARY KEY (report_id, drug)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS event_reactions (
+                report_id TEXT NOT NULL,
+                reaction TEXT NOT NULL,
+                report_date TEXT,
+                PRIMARY KEY (report_id, reaction)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS event_pairs (
+                report_id TEXT NOT NULL,
+                drug TEXT NOT NULL,
+                reaction TEXT NOT NULL,
+                report_date TEXT,
+                PRIMARY KEY (report_id, drug, reaction)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_event_drugs_date ON event_drugs (report_date);
+            CREATE INDEX IF NOT EXISTS idx_event_reactions_date
+                ON event_reactions (report_date);
+            CREATE INDEX IF NOT EXISTS idx_event_pairs_date ON event_pairs (report_date);
+
+            -- 已推送过的安全信号
+            CREATE TABLE IF NOT EXISTS signals (
+                drug TEXT NOT NULL,
+                reaction TEXT NOT NULL,
+                first_flagged REAL NOT NULL,
+                prr REAL,
+                ror REAL,
+                report_count INTEGER,
+                PRIMARY KEY (drug, reaction)
+            ) WITHOUT ROWID;
+            """)
+        self.conn.commit()
+
+    def add(self, endpoint_type, results):
+        """归档一批原始记录（提取为未经显示格式化的标准字段后保存），返回写入条数"""
+        return self.add_batches([(endpoint_type, results)])[0]
+
+    def add_batches(self, batches):
+        """在一个事务中归档多批原始记录 [(端点类型, 记录列表)]，返回每批的写入条数"""
+        now = time.time()
+        rows = []
+        drug_rows = []
+        reaction_rows = []
+        pair_rows = []
+        counts = []
+        for endpoint_type, results in batches:
+            extractor = EXTRACTORS[endpoint_type]
+            for item in results:
+                record = extractor.normalize(item)
+                data = json.dumps(record, ensure_ascii=False)
+                # 没有唯一标识的记录按内容去重
+                record_id = record["id"] or hashlib.sha1(data.encode("utf-8")).hexdigest()
+                record_date = _format_date(str(extractor.get_date(item))) or None
+                columns = {
+                    column: str(get(item)) for column, get in extractor.archive_columns
+                }
+                rows.append(
+                    (
+                        endpoint_type,
+                        record_id,
+                        record_date,
+                        str(record["title"]) if record["title"] else None,
+                        columns.get("classification") or None,
+                        columns.get("manufacturer") or None,
+                        data,
+                        now,
+                    )
+                )
+                if extractor.get_drugs:
+                    drugs = extractor.get_drugs(item)
+                    reactions = extractor.get_reactions(item)
+                    drug_rows += [(record_id, drug, record_date) for drug in drugs]
+                    reaction_rows += [(record_id, r, record_date) for r in reactions]
+                    pair_rows += [
+                        (record_id, drug, reaction, record_date)
+                        for drug in drugs
+                        for reaction in reactions
+                    ]
+            counts.append(len(results))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fda_records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if drug_rows:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO event_drugs VALUES (?, ?, ?)", drug_rows
+                )
+            if reaction_rows:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO event_reactions VALUES (?, ?, ?)",
+                    reaction_rows,
+                )
+            if pair_rows:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO event_pairs VALUES (?, ?, ?, ?)", pair_rows
+                )
+            self.conn.commit()
+        return counts
+
+    def signal_counts(self, since, min_count=3):
+        """统计 since（YYYY-MM-DD）以来的不良事件计数，聚合在 SQLite 中完成
+
+        返回 (报告总数, {药品: 报告数}, {反应: 报告数}, [(药品, 反应, 报告数)])，
+        组合只返回报告数不少于 min_count 的。总数和各边际计数都只统计同时有药品和
+        反应的报告，与组合计数（只来自这些报告）口径一致。
+        """
+        reports = (
+            "SELECT report_id FROM event_drugs WHERE report_date >= :since "
+            "INTERSECT SELECT report_id FROM event_reactions WHERE report_date >= :since"
+        )
+        params = {"since": since, "min_count": min_count}
+        with self.lock:
+            total = self.conn.execute(
+                f"SELECT COUNT(*) FROM ({reports})", params
+            ).fetchone()[0]
+            drug_counts = dict(
+                self.conn.execute(
+                    "SELECT drug, COUNT(*) FROM event_drugs WHERE report_date >= :since "
+                    f"AND report_id IN ({reports}) GROUP BY drug",
+                    params,
+                )
+            )
+            reaction_counts = dict(
+                self.conn.execute(
+                    "SELECT reaction, COUNT(*) FROM event_reactions "
+                    f"WHERE report_date >= :since AND report_id IN ({reports}) "
+                    "GROUP BY reaction",
+                    params,
+                )
+            )
+            pair_counts = self.conn.execute(
+                "SELECT drug, reaction, COUNT(*) AS n FROM event_pairs "
+                "WHERE report_date >= :since GROUP BY drug, reaction HAVING n >= :min_count",
+                params,
+            ).fetchall()
+        return total, drug_counts, reaction_counts, pair_counts
+
+    def filter_new_signals(self, signals):
+        """过滤出之前没有推送过的信号"""
+        with self.lock:
+            known = {
+                tuple(row)
+                for row in self.conn.execute("SELECT drug, reaction FROM signals")
+            }
+        return [s for s in signals if (s["drug"], s["reaction"]) not in known]
+
+    def mark_signals(self, signals):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO signals VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (s["drug"], s["reaction"], now, s["prr"], s["ror"], s["count"])
+                    for s in signals
+                ],
+            )
+            self.conn.commit()
+
+    def query(
+        self,
+        endpoint=None,
+        since=None,
+        until=None,
+        name=None,
+        classification=None,
+        group_by=None,
+        limit=100,
+    ):
+        """查询归档记录
+
+        since / until 为 YYYY-MM-DD 格式的日期（包含边界），name 按前缀匹配（不区分大小写）。
+        指定 group_by 时返回 [(分组值, 记录数)]，按记录数降序；否则返回记录字典列表，按日期降序。
+        """
+        conditions = []
+        params = []
+        if endpoint:
+            conditions.append("endpoint = ?")
+            params.append(endpoint)
+        if since:
+            conditions.append("record_date >= ?")
+            params.append(since)
+        if until:
+            conditions.append("record_date <= ?")
+            params.append(until)
+        if name:
+            conditions.append("name LIKE ?")
+            params.append(f"{name}%")
+        if classification:
+            conditions.append("classification = ?")
+            params.append(classification)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if group_by:
+            column = self.GROUP_BY_COLUMNS.get(group_by)
+            if not column:
+                raise ValueError(f"不支持的分组维度: {group_by}")
+            sql = (
+                f"SELECT {column} AS key, COUNT(*) AS total FROM fda_records {where} "
+                f"GROUP BY key ORDER BY total DESC LIMIT ?"
+            )
+            with self.lock:
+                rows = self.conn.execute(sql, [*params, limit]).fetchall()
+            return [tuple(row) for row in rows]
+
+        sql = (
+            f"SELECT endpoint, record_date, data FROM fda_records {where} "
+            f"ORDER BY record_date DESC LIMIT ?"
+        )
+        with self.lock:
+            rows = self.conn.execute(sql, [*params, limit]).fetchall()
+        return [
+            {**json.loads(data), "endpoint": endpoint, "date": record_date}
+            for endpoint, record_date, data in rows
+        ]
+
+    def close(self):
+        self.conn.close()
+
+
+def format_message(data, report_type):
+    """格式化消息内容 - 参考 trendrader 风格"""
+    try:
+        extractor, rendered = _render_results(data, report_type)
+        if not rendered:
+            return None
+
+        # 构建消息文本
+        text_lines = [f"{extractor.emoji} FDA {report_type} 最新数据更新"]
+        text_lines.append(f"共 {get_result_total(data)} 条记录")
+        text_lines.append("")  # 空行
+
+        for i, (text, _, _) in enumerate(rendered, 1):
+            text_lines.append(f"{i}. {text}")
+            text_lines.append("")  # 每条记录后空行
+
+        formatted_text = "\n".join(text_lines)
+        logger.info(f"成功格式化 {report_type} 消息")
+        return formatted_text
+    except Exception as e:
+        logger.error(f"格式化 {report_type} 消息时出错: {str(e)}", exc_info=True)
+        return None
+
+
+def format_message_with_links(data, report_type):
+    """格式化消息内容 - 带链接的富文本格式"""
+    try:
+        _, rendered = _render_results(data, report_type)
+        if not rendered:
+            return None
+
+        # 标题行
+        content_blocks = [
+            [{"tag": "text", "text": f"共 {get_result_total(data)} 条记录\n\n"}]
+        ]
+        content_blocks.extend(
+            [{"tag": "text", "text": f"{i}. "}, *rich]
+            for i, (_, _, rich) in enumerate(rendered, 1)
+        )
+
+        logger.info(f"成功格式化 {report_type} 消息（富文本格式）")
+        return content_blocks
+    except Exception as e:
+        logger.error(f"格式化 {report_type} 消息时出错: {str(e)}", exc_info=True)
+        return None
+
+
+def number_record_texts(messages):
+    """给渲染好的推送文本加上序号（序号单独一行）"""
+    return [f"{i}. \n{message}" for i, message in enumerate(messages, 1)]
+
+
+def format_record_texts(data, report_type):
+    """格式化为推送消息中的记录文本列表（带序号，链接显示为 标题 (URL)），
+    没有可显示的数据时返回 None"""
+    try:
+        _, rendered = _render_results(data, report_type)
+        if not rendered:
+            return None
+        record_texts = number_record_texts([message for _, message, _ in rendered])
+        logger.info(f"成功格式化 {report_type} 消息")
+        return record_texts
+    except Exception as e:
+        logger.error(f"格式化 {report_type} 消息时出错: {str(e)}", exc_info=True)
+        return None
+
+
+def post_to_feishu(payload, description, webhook=None, limiter=None):
+    """发送一条消息到飞书 - 经过限流器，返回是否成功
+
+    网络错误、429 和 5xx 由 http_request 重试；这里只在飞书返回非零业务 code
+    （HTTP 200，如触发频率限制）时指数退避重试。webhook 默认为 FEISHU_WEBHOOK。
+    """
+    import requests
+
+    webhook = webhook or get_config().feishu_webhook
+    for attempt in range(FEISHU_SEND_RETRIES + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            with metrics.timer("fda_send_seconds"):
+                response = http_request("POST", webhook, json=payload)
+            response.raise_for_status()
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            error = "请求超时" if isinstance(e, requests.exceptions.Timeout) else str(e)
+            logger.error(f"❌ 发送 {description} 失败: {error}")
+            metrics.inc("fda_messages_sent_total", result="failed")
+            return False
+        except ValueError as e:
+            logger.error(f"❌ 发送 {description} 失败: 响应解析失败: {str(e)}")
+            metrics.inc("fda_messages_sent_total", result="failed")
+            return False
+
+        # 飞书在 HTTP 200 时通过 code 字段返回业务错误
+        code = result.get("code") if isinstance(result, dict) else None
+        if not code:
+            logger.info(f"✅ 成功发送 {description} 到飞书，响应: {result}")
+            metrics.inc("fda_messages_sent_total", result="ok")
+            return True
+        error = f"飞书返回错误: {result}"
+        if attempt >= FEISHU_SEND_RETRIES:
+            break
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2**attempt)
+        logger.warning(
+            f"发送 {description} 失败: {error}，{delay:.1f} 秒后重试 "
+            f"({attempt + 1}/{FEISHU_SEND_RETRIES})"
+        )
+        metrics.inc("fda_send_retries_total")
+        time.sleep(delay)
+
+    logger.error(f"❌ 发送 {description} 失败: {error}")
+    metrics.inc("fda_messages_sent_total", result="failed")
+    return False
+
+
+class CircuitBreaker:
+    """熔断器 - 连续失败 threshold 次后断开，reset_after 秒后放行一次试探请求，成功则恢复"""
+
+    def __init__(
+        self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_after=CIRCUIT_RESET_SECONDS
+    ):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """是否允许发送"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_after:
+                self.opened_at = now  # 试探请求返回之前不放行其他请求
+                return True
+            return False
+
+    def record(self, ok):
+        """记录一次发送结果"""
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+
+class Sink:
+    """推送目的地 - 子类实现 send()，reports 和 watchlist 决定哪些记录发往这里
+
+    - reports: 接收的消息类别（端点类型、signals、digest、errors），为空时接收全部
+    - watchlist: 关注词列表或关注列表文件路径，配置后只接收命中任一关注词的记录，
+      每个目的地的消息只包含它接收的记录（错误通知不受关注列表限制）
+    """
+
+    def __init__(self, name, reports=None, watchlist=None):
+        self.name = name
+        self.reports = set(reports or [])
+        if isinstance(watchlist, str):
+            watchlist = load_watchlist(watchlist)
+        self.watchlist = WatchlistMatcher(watchlist) if watchlist else None
+        self.breaker = CircuitBreaker()
+
+    def accepts(self, category):
+        """是否接收该类别的消息"""
+        return not self.reports or category in self.reports
+
+    def wants(self, record, extractor=None, text=None):
+        """是否接收这条记录 - 端点记录用提取器匹配关注字段，其他记录匹配 text(记录) 的文本"""
+        if self.watchlist is None:
+            return True
+        if extractor is not None:
+            return extractor.watch_matches(self.watchlist, record)
+        return self.watchlist.search(text(record))
+
+    def send(self, payload, description):
+        """发送一条消息，返回是否成功（在发送池的线程中调用，可以阻塞）"""
+        raise NotImplementedError
+
+
+class FeishuSink(Sink):
+    """飞书自定义机器人 Webhook，每个目的地使用自己的限流器"""
+
+    def __init__(self, name, webhook, rate_limit=None, **options):
+        super().__init__(name, **options)
+        self.webhook = webhook
+        self.limiter = TokenBucket(rate_limit or get_config().feishu_rate_limit)
+
+    def send(self, payload, description):
+        return post_to_feishu(payload, description, self.webhook, self.limiter)
+
+
+class FileSink(Sink):
+    """把消息以 JSON Lines 追加到本地文件，path 为 "-" 时输出到标准输出"""
+
+    def __init__(self, name, path="-", **options):
+        super().__init__(name, **options)
+        self.path = path
+        self.lock = threading.Lock()
+
+    def send(self, payload, description):
+        line = json.dumps(
+            {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "destination": self.name,
+                "description": description,
+                "payload": payload,
+            },
+            ensure_ascii=False,
+        )
+        with self.lock:
+            if self.path == "-":
+                print(line, flush=True)
+            else:
+                path = Path(self.path)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        return True
+
+
+# 目的地类型，destinations.json 中的 type 字段（新增类型只需在这里注册）
+SINK_TYPES = {
+    "feishu": FeishuSink,
+    "file": FileSink,
+}
+
+
+def load_sinks(path=None):
+    """读取推送目的地配置，文件不存在时使用 FEISHU_WEBHOOK 作为唯一的目的地
+
+    配置文件为 JSON 列表，每项包含 name、type（默认 feishu）以及该类型的参数，
+    如 webhook（或从环境变量读取的 webhook_env）、rate_limit、path、reports、watchlist。
+    """
+    config = get_config()
+    path = Path(path or config.destinations_file)
+    if not path.exists():
+        if not config.feishu_webhook:
+            return []
+        return [FeishuSink(DEFAULT_DESTINATION, config.feishu_webhook)]
+
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    sinks = []
+    for entry in entries:
+        options = dict(entry)
+        sink_type = options.pop("type", "feishu")
+        if sink_type not in SINK_TYPES:
+            raise ValueError(f"未知的目的地类型: {sink_type}")
+        webhook_env = options.pop("webhook_env", None)
+        if webhook_env:
+            options["webhook"] = os.environ.get(webhook_env)
+            if not options["webhook"]:
+                logger.warning(f"目的地 {entry.get('name')} 的 {webhook_env} 未配置，已跳过")
+                continue
+        try:
+            sinks.append(SINK_TYPES[sink_type](**options))
+        except TypeError as e:
+            raise ValueError(f"目的地配置错误 {entry}: {str(e)}") from e
+
+    names = [sink.name for sink in sinks]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"目的地名称重复: {', '.join(sorted(duplicates))}")
+    return sinks
+
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def get_sinks():
+    """获取共享的推送目的地列表（首次使用时读取配置，熔断状态在进程内保留）"""
+    global _sinks
+    if _sinks is None:
+        with _sinks_lock:
+            if _sinks is None:
+                _sinks = load_sinks()
+                if _sinks:
+                    logger.info(
+                        f"推送目的地: {', '.join(sink.name for sink in _sinks)}"
+                    )
+    return _sinks
+
+
+class SenderPool:
+    """异步发送池 - 每个目的地一个协程依次发送，不同目的地之间并发
+
+    阻塞的发送在线程池中执行（每个目的地同时最多占用一个线程），一个目的地变慢或
+    熔断不会拖住其他目的地；熔断期间的消息直接记为失败，保留在 outbox 中下次补发。
+    因熔断而没有实际发送的投递记录在 skipped 中，不计入尝试次数。
+    """
+
+    def __init__(self, sinks):
+        self.sinks = {sink.name: sink for sink in sinks}
+        self.skipped = set()
+
+    def deliver(self, deliveries):
+        """发送 [(键, 目的地, 描述, payload)]，返回 {(键, 目的地): 错误信息，成功时为 None}"""
+        import asyncio
+
+        by_destination = {}
+        for delivery in deliveries:
+            by_destination.setdefault(delivery[1], []).append(delivery)
+        if not by_destination:
+            return {}
+        return asyncio.run(self._deliver_all(by_destination))
+
+    async def _deliver_all(self, by_destination):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        loop = asyncio.get_running_loop()
+        results = {}
+        with ThreadPoolExecutor(
+            max_workers=len(by_destination), thread_name_prefix="sender"
+        ) as executor:
+            for partial in await asyncio.gather(
+                *(
+                    self._deliver_to(loop, executor, name, items)
+                    for name, items in by_destination.items()
+                )
+            ):
+                results.update(partial)
+        return results
+
+    async def _deliver_to(self, loop, executor, name, deliveries):
+        sink = self.sinks.get(name)
+        results = {}
+        for key, _, description, payload in deliveries:
+            if sink is None:
+                error = f"未配置的目的地 {name}"
+            elif not sink.breaker.allow():
+                error = f"目的地 {name} 已熔断"
+                self.skipped.add((key, name))
+            else:
+                try:
+                    ok = await loop.run_in_executor(
+                        executor, sink.send, payload, description
+                    )
+                except Exception as e:
+                    logger.error(f"发送 {description}到 {name} 时出错: {str(e)}")
+                    ok = False
+                sink.breaker.record(ok)
+                error = None if ok else "发送失败"
+            metrics.inc(
+                "fda_deliveries_total",
+                destination=name,
+                result="ok" if error is None else "failed",
+            )
+            results[(key, name)] = error
+        if sink:
+            metrics.set("fda_circuit_open", int(sink.breaker.is_open), destination=name)
+            if sink.breaker.is_open:
+                logger.warning(f"目的地 {name} 连续发送失败，已暂停发送")
+        return results
+
+
+def route_messages(messages, category):
+    """按各目的地的 reports 为整条消息选择目的地，返回 {键: [目的地名称]}
+
+    只用于不按记录拆分的消息（如错误通知）；记录消息在打包前用 route_records 路由。
+    """
+    names = [sink.name for sink in get_sinks() if sink.accepts(category)]
+    return {key: list(names) for key, _, _ in messages}
+
+
+def route_records(category, records, text=None):
+    """在打包为消息之前逐条为记录选择目的地，返回 [(记录列表, 目的地名称列表)]
+
+    records 为端点的原始记录时用提取器匹配各目的地的关注字段；传入 text 时
+    records 为其他记录（如信号、摘要段落），匹配 text(记录) 返回的文本。
+    接收同样记录的目的地合为一组，共用同样的消息。
+    """
+    extractor = EXTRACTORS.get(category) if text is None else None
+    groups = {}
+    for sink in get_sinks():
+        if not sink.accepts(category):
+            continue
+        selected = tuple(
+            i for i, record in enumerate(records) if sink.wants(record, extractor, text)
+        )
+        if selected:
+            groups.setdefault(selected, []).append(sink.name)
+    return [
+        ([records[i] for i in selected], names) for selected, names in groups.items()
+    ]
+
+
+def build_routed_messages(groups, build):
+    """为 route_records 的每组目的地生成消息，返回 (消息列表, {键: [目的地名称]})
 
-        results = data["results"]
-        total = len(results)
+    build(记录列表) 返回这组记录的消息 [(键, 描述, payload)]；不同组生成了
+    同一幂等键的消息时只保留一条，目的地合并。
+    """
+    messages = []
+    routes = {}
+    for records, names in groups:
+        for message in build(records) or []:
+            key = message[0]
+            if key not in routes:
+                messages.append(message)
+                routes[key] = []
+            routes[key].extend(name for name in names if name not in routes[key])
+    return messages, routes
 
-        if total == 0:
-            logger.info(f"{report_type} 没有新数据")
-            return None
 
-        # 根据类型选择 emoji
-        emoji_map = {"药品不良事件": "⚠️", "警告信": "🚨", "药品标签": "💊"}
-        emoji = emoji_map.get(report_type, "📊")
+def deliver_messages(messages, category, routes=None):
+    """不经过 outbox，直接把消息 [(键, 描述, payload)] 发往匹配的目的地，全部送达时返回 True
 
-        # 构建消息文本
-        text_lines = [f"{emoji} FDA {report_type} 最新数据更新"]
-        text_lines.append(f"共 {total} 条记录")
-        text_lines.append("")  # 空行
+    routes 为 route_records 得到的 {键: [目的地名称]}，省略时按类别路由整条消息。
+    """
+    if routes is None:
+        routes = route_messages(messages, category)
+    deliveries = [
+        (key, name, description, payload)
+        for key, description, payload in messages
+        for name in routes[key]
+    ]
+    results = SenderPool(get_sinks()).deliver(deliveries)
+    return all(error is None for error in results.values())
 
-        for i, item in enumerate(results[:10], 1):  # 显示前10条
-            if report_type == "药品不良事件":
-                # 获取药品名称
-                patient = item.get("patient", {})
-                drugs = patient.get("drug", [])
-                if drugs:
-                    drug_name = drugs[0].get("medicinalproduct", "未知药品")
-                else:
-                    drug_name = "未知药品"
-
-                # 获取严重性
-                serious = item.get("serious", "未知")
-                reaction = (
-                    item.get("patient", {})
-                    .get("reaction", [{}])[0]
-                    .get("reactionmeddrapt", "")
-                )
 
-                text_lines.append(f"{i}. {drug_name}")
-                if reaction:
-                    text_lines.append(f"   反应: {reaction}")
-
-            elif report_type == "警告信":
-                # 产品描述
-                product = item.get("product_description", "未知产品")[:80]
-                # 召回原因
-                reason = item.get("reason_for_recall", "未说明")[:50]
-                # 召回日期
-                recall_date = item.get("report_date", "")
-                # 分类
-                classification = item.get("classification", "")
-
-                text_lines.append(f"{i}. {product}")
-                text_lines.append(f"   原因: {reason}")
-                if recall_date:
-                    text_lines.append(f"   日期: {recall_date}")
-                if classification:
-                    text_lines.append(f"   级别: Class {classification}")
-
-            elif report_type == "药品标签":
-                # 品牌名称
-                openfda = item.get("openfda", {})
-                brand_names = openfda.get("brand_name", [])
-                brand_name = brand_names[0] if brand_names else "未知"
-
-                # 通用名称
-                generic_names = openfda.get("generic_name", [])
-                generic_name = generic_names[0] if generic_names else ""
-
-                # 制造商
-                manufacturers = openfda.get("manufacturer_name", [])
-                manufacturer = manufacturers[0] if manufacturers else ""
-
-                text_lines.append(f"{i}. {brand_name}")
-                if generic_name:
-                    text_lines.append(f"   通用名: {generic_name}")
-                if manufacturer:
-                    text_lines.append(f"   制造商: {manufacturer[:40]}")
+def send_to_feishu(total_titles, timestamp, report_type, text):
+    """发送纯文本消息 - 作为一条记录文本发送"""
+    return send_record_texts(
+        total_titles, timestamp, report_type, [text.rstrip("\n")]
+    )
 
-            text_lines.append("")  # 每条记录后空行
 
-        formatted_text = "\n".join(text_lines)
-        logger.info(f"成功格式化 {report_type} 消息")
-        return formatted_text
-    except Exception as e:
-        logger.error(f"格式化 {report_type} 消息时出错: {str(e)}", exc_info=True)
-        return None
+def _block_to_text(block):
+    """把一条记录的富文本块转换为纯文本，链接显示为 文本 (URL)"""
+    lines = []
+    for item in block:
+        if item["tag"] == "text":
+            lines.append(item["text"].rstrip("\n"))
+        elif item["tag"] == "a":
+            lines.append(f"{item['text']} ({item['href']})")
+    return "\n".join(lines)
 
 
-def format_message_with_links(data, report_type):
-    """格式化消息内容 - 带链接的富文本格式"""
-    try:
-        import urllib.parse
+def pack_messages(record_texts, max_bytes):
+    """把记录文本按顺序打包成多条消息，每条消息的正文不超过 max_bytes 字节（UTF-8）
 
-        if not data or "results" not in data:
-            logger.warning(f"{report_type} 数据为空或格式不正确")
-            return None
+    返回记录文本列表的列表；单条记录超过上限时会被截断。
+    """
+    chunks = []
+    current = []
+    size = 0
+    for text in record_texts:
+        encoded = text.encode("utf-8")
+        if len(encoded) + 1 > max_bytes:
+            text = encoded[: max_bytes - 4].decode("utf-8", errors="ignore") + "…"
+            encoded = text.encode("utf-8")
+        length = len(encoded) + 1  # 记录之间的换行符
+        if current and size + length > max_bytes:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += length
+    if current:
+        chunks.append(current)
+    return chunks
 
-        results = data["results"]
-        total = len(results)
 
-        if total == 0:
-            logger.info(f"{report_type} 没有新数据")
-            return None
+def build_feishu_messages(
+    total_titles, timestamp, report_type, record_texts, pushed=None, key_scope=None
+):
+    """把记录文本打包为待发送的飞书消息列表 [(幂等键, 描述, payload)]
 
-        # 构建富文本内容
-        content_blocks = []
+    record_texts 为每条记录渲染好的文本（见 format_record_texts）。pushed 为本次
+    推送的记录数，与总数不同时会显示在标题行中。
 
-        # 标题行
-        content_blocks.append([{"tag": "text", "text": f"共 {total} 条记录\n\n"}])
-
-        for i, item in enumerate(results[:10], 1):  # 显示前10条
-            block = []
-
-            if report_type == "药品不良事件":
-                patient = item.get("patient", {})
-                drugs = patient.get("drug", [])
-                drug_name = (
-                    drugs[0].get("medicinalproduct", "未知药品")
-                    if drugs
-                    else "未知药品"
-                )
-                reactions = patient.get("reaction", [])
-                reaction = reactions[0].get("reactionmeddrapt", "") if reactions else ""
-
-                # 获取接收日期
-                receive_date = item.get("receivedate", "")
-                if receive_date and len(receive_date) >= 8:
-                    receive_date = (
-                        f"{receive_date[:4]}-{receive_date[4:6]}-{receive_date[6:8]}"
-                    )
+    记录较多时拆分为多条消息。幂等键只由报告类型和记录内容决定（不含时间戳），
+    同样的内容重复生成时键不变，保证补发不会重复推送。内容可能在不同时间合理地重复
+    （如数据摘要）时，用 key_scope（如日期）区分各次推送。
+    """
+    # 根据类型选择 emoji
+    extractor = get_extractor(report_type)
+    emoji = extractor.emoji if extractor else "📊"
 
-                # 获取 safety report id
-                safetyreportid = item.get("safetyreportid", "")
+    # 按消息大小上限打包，标题行和 JSON 结构预留 FEISHU_HEADER_RESERVE 字节
+    chunks = pack_messages(
+        record_texts, get_config().feishu_max_message_bytes - FEISHU_HEADER_RESERVE
+    )
 
-                # 构建 OpenFDA 查看器链接
-                if safetyreportid:
-                    search_url = f"https://open.fda.gov/apis/drug/event/explore/?search=safetyreportid:{safetyreportid}"
-                else:
-                    search_term = urllib.parse.quote(drug_name)
-                    search_url = f"https://open.fda.gov/apis/drug/event/explore/?search=patient.drug.medicinalproduct:{search_term}"
-
-                block.append({"tag": "text", "text": f"{i}. "})
-                block.append({"tag": "a", "text": drug_name, "href": search_url})
-                if reaction:
-                    block.append({"tag": "text", "text": f"\n   反应: {reaction}"})
-                if receive_date:
-                    block.append({"tag": "text", "text": f"\n   日期: {receive_date}"})
-                if safetyreportid:
-                    block.append(
-                        {"tag": "text", "text": f"\n   报告ID: {safetyreportid}"}
-                    )
-                block.append({"tag": "text", "text": "\n\n"})
-
-            elif report_type == "警告信":
-                product = item.get("product_description", "未知产品")[:80]
-                reason = item.get("reason_for_recall", "未说明")[:50]
-                recall_date = item.get("report_date", "")
-                classification = item.get("classification", "")
-                recall_number = item.get("recall_number", "")
-
-                # 构建 OpenFDA 查看器链接
-                if recall_number:
-                    enforcement_url = f"https://open.fda.gov/apis/drug/enforcement/explore/?search=recall_number:{recall_number}"
-                else:
-                    search_term = urllib.parse.quote(product[:50])
-                    enforcement_url = f"https://open.fda.gov/apis/drug/enforcement/explore/?search=product_description:{search_term}"
-
-                block.append({"tag": "text", "text": f"{i}. "})
-                block.append({"tag": "a", "text": product, "href": enforcement_url})
-                block.append({"tag": "text", "text": f"\n   原因: {reason}"})
-                if recall_date:
-                    block.append({"tag": "text", "text": f"\n   日期: {recall_date}"})
-                if classification:
-                    block.append(
-                        {"tag": "text", "text": f"\n   级别: Class {classification}"}
-                    )
-                if recall_number:
-                    block.append(
-                        {"tag": "text", "text": f"\n   召回编号: {recall_number}"}
-                    )
-                block.append({"tag": "text", "text": "\n\n"})
-
-            elif report_type == "药品标签":
-                openfda = item.get("openfda", {})
-                brand_names = openfda.get("brand_name", [])
-                brand_name = brand_names[0] if brand_names else "未知"
-                generic_names = openfda.get("generic_name", [])
-                generic_name = generic_names[0] if generic_names else ""
-                manufacturers = openfda.get("manufacturer_name", [])
-                manufacturer = manufacturers[0] if manufacturers else ""
-
-                # 获取生效日期
-                effective_time = item.get("effective_time", "")
-                if effective_time and len(effective_time) >= 8:
-                    effective_time = f"{effective_time[:4]}-{effective_time[4:6]}-{effective_time[6:8]}"
-
-                # 获取 set_id（药品标签的唯一标识）
-                set_id = item.get("set_id", "")
-
-                # 构建链接
-                if set_id:
-                    label_url = f"https://dailymed.nlm.nih.gov/dailymed/drugInfo.cfm?setid={set_id}"
-                else:
-                    search_term = urllib.parse.quote(brand_name)
-                    label_url = f"https://dailymed.nlm.nih.gov/dailymed/search.cfm?labeltype=all&query={search_term}"
-
-                block.append({"tag": "text", "text": f"{i}. "})
-                block.append({"tag": "a", "text": brand_name, "href": label_url})
-                if generic_name:
-                    block.append(
-                        {"tag": "text", "text": f"\n   通用名: {generic_name}"}
-                    )
-                if manufacturer:
-                    block.append(
-                        {"tag": "text", "text": f"\n   制造商: {manufacturer[:40]}"}
-                    )
-                if effective_time:
-                    block.append(
-                        {"tag": "text", "text": f"\n   生效日期: {effective_time}"}
-                    )
-                block.append({"tag": "text", "text": "\n\n"})
+    messages = []
+    for index, chunk in enumerate(chunks, 1):
+        part = f"（{index}/{len(chunks)}）" if len(chunks) > 1 else ""
+        text_lines = [f"{emoji} FDA {report_type} 最新数据{part}"]
+        if pushed is None or str(pushed) == str(total_titles):
+            text_lines.append(f"共 {total_titles} 条记录")
+        else:
+            text_lines.append(f"共 {total_titles} 条记录，本次推送 {pushed} 条")
+        text_lines.append(f"更新时间: {timestamp}\n")
+        text_lines.extend(chunk)
 
-            content_blocks.append(block)
+        payload = {
+            "message_type": "text",
+            "content": {
+                "total_titles": str(total_titles),
+                "timestamp": timestamp,
+                "report_type": report_type,
+                "text": "\n".join(text_lines),
+            },
+        }
+        if key_scope is None:
+            key = Outbox.make_key(report_type, chunk)
+        else:
+            key = Outbox.make_key(report_type, key_scope, chunk)
+        messages.append((key, f"{report_type} 消息{part}", payload))
+    return messages
 
-        logger.info(f"成功格式化 {report_type} 消息（富文本格式）")
-        return content_blocks
-    except Exception as e:
-        logger.error(f"格式化 {report_type} 消息时出错: {str(e)}", exc_info=True)
-        return None
 
+def send_to_feishu_rich(total_titles, timestamp, report_type, content_blocks):
+    """发送富文本消息 - 各记录块转换为纯文本后按 send_record_texts 发送"""
+    record_texts = [_block_to_text(block) for block in content_blocks[1:]]
+    return send_record_texts(total_titles, timestamp, report_type, record_texts)
 
-def send_to_feishu(total_titles, timestamp, report_type, text):
-    """发送消息到飞书 - 使用富文本格式支持链接"""
-    if not FEISHU_WEBHOOK:
-        logger.error("飞书 Webhook URL 未配置")
-        return False
 
-    # 使用富文本格式，支持链接
-    payload = {
-        "msg_type": "post",
-        "content": {
-            "post": {
-                "zh_cn": {
-                    "title": f"{report_type} - {total_titles} 条记录",
-                    "content": [
-                        [{"tag": "text", "text": f"⏰ 更新时间: {timestamp}\n\n{text}"}]
-                    ],
-                }
-            }
-        },
-    }
+def send_record_texts(total_titles, timestamp, report_type, record_texts):
+    """发送记录文本到匹配的目的地（不经过 outbox），记录较多时拆分为多条消息
 
-    try:
-        logger.info(f"正在发送 {report_type} 消息到飞书...")
-        response = requests.post(FEISHU_WEBHOOK, json=payload, timeout=10)
-        response.raise_for_status()
+    关注列表按每条记录的文本匹配，每个目的地只收到它接收的记录。
+    """
+    if not get_sinks():
+        logger.error("没有配置推送目的地（FEISHU_WEBHOOK 或 destinations.json）")
+        return False
 
-        result = response.json()
-        logger.info(f"✅ 成功发送 {report_type} 消息到飞书，响应: {result}")
+    extractor = get_extractor(report_type)
+    category = extractor.endpoint_type if extractor else report_type
+    messages, routes = build_routed_messages(
+        route_records(category, record_texts, text=str),
+        lambda texts: build_feishu_messages(total_titles, timestamp, report_type, texts),
+    )
+    if deliver_messages(messages, category, routes):
         return True
-    except requests.exceptions.Timeout:
-        logger.error(f"❌ 发送 {report_type} 消息超时")
-        return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ 发送 {report_type} 消息失败: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(
-            f"❌ 发送 {report_type} 消息时发生未知错误: {str(e)}", exc_info=True
+    logger.error(f"❌ {report_type} 共 {len(messages)} 条消息，部分发送失败")
+    return False
+
+
+class Outbox:
+    """待发送消息日志 - 发送前写入，收到 2xx 后标记完成，未完成的消息下次运行时补发
+
+    每条消息对每个目的地有一条投递记录，各目的地分别标记完成和补发。投递的状态为
+    pending（待发送）、done（已送达）或 dead（尝试 max_attempts 次仍失败，不再补发，
+    如 Webhook 永久拒绝或目的地已从配置中移除）。
+    """
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                idem_key TEXT PRIMARY KEY,
+                description TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+            """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, created_at)"
         )
-        return False
+        migrate = not self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'outbox_deliveries'"
+        ).fetchone()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox_deliveries (
+                idem_key TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                sent_at REAL,
+                PRIMARY KEY (idem_key, destination)
+            ) WITHOUT ROWID
+            """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_status "
+            "ON outbox_deliveries (status)"
+        )
+        if migrate:
+            # 升级前写入的消息只有一个目的地（FEISHU_WEBHOOK）
+            self.conn.execute(
+                "INSERT INTO outbox_deliveries "
+                "SELECT idem_key, ?, status, attempts, last_error, sent_at FROM outbox",
+                (DEFAULT_DESTINATION,),
+            )
+        self.conn.commit()
 
+    @staticmethod
+    def make_key(*parts):
+        """根据消息内容生成幂等键"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-def send_to_feishu_rich(total_titles, timestamp, report_type, content_blocks):
-    """发送富文本消息到飞书 - 支持链接"""
-    if not FEISHU_WEBHOOK:
-        logger.error("飞书 Webhook URL 未配置")
-        return False
+    def add(self, messages, routes):
+        """写入待发送消息 [(幂等键, 描述, payload)] 及其目的地 {幂等键: [目的地]}
 
-    # 根据类型选择 emoji
-    emoji_map = {"药品不良事件": "⚠️", "警告信": "🚨", "药品标签": "💊"}
-    emoji = emoji_map.get(report_type, "📊")
+        已存在的消息和投递（包括已发送的）会被忽略，新增的目的地会补上投递记录。
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox (idem_key, description, payload, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (key, description, json.dumps(payload, ensure_ascii=False), now)
+                    for key, description, payload in messages
+                ],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox_deliveries (idem_key, destination) "
+                "VALUES (?, ?)",
+                [
+                    (key, destination)
+                    for key, _, _ in messages
+                    for destination in routes.get(key, [])
+                ],
+            )
+            self.conn.commit()
+
+    def pending(self, keys=None):
+        """按写入顺序返回未送达的投递 [(幂等键, 目的地, 描述, payload)]，可以只查询指定的消息"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT d.idem_key, d.destination, o.description, o.payload "
+                "FROM outbox_deliveries d JOIN outbox o ON o.idem_key = d.idem_key "
+                "WHERE d.status = 'pending' ORDER BY o.created_at, o.rowid"
+            ).fetchall()
+        if keys is not None:
+            keys = set(keys)
+            rows = [row for row in rows if row[0] in keys]
+        return [
+            (key, destination, description, json.loads(payload))
+            for key, destination, description, payload in rows
+        ]
 
-    # 将 content_blocks 转换为纯文本（因为飞书 Webhook 可能不支持富文本）
-    text_lines = [f"{emoji} FDA {report_type} 最新数据"]
-    text_lines.append(f"共 {total_titles} 条记录")
-    text_lines.append(f"更新时间: {timestamp}\n")
+    def mark_done(self, key, destination):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox_deliveries SET status = 'done', sent_at = ?, "
+                "attempts = attempts + 1 WHERE idem_key = ? AND destination = ?",
+                (time.time(), key, destination),
+            )
+            self.conn.commit()
 
-    for block in content_blocks[1:]:  # 跳过第一个标题块
-        for item in block:
-            if item["tag"] == "text":
-                text_lines.append(item["text"].rstrip("\n"))
-            elif item["tag"] == "a":
-                # 将链接格式化为文本
-                text_lines.append(f"{item['text']} ({item['href']})")
+    def mark_failed(self, key, destination, error, attempted=True, max_attempts=None):
+        """记录一次发送失败，返回该投递是否因达到 max_attempts 次而被标记为 dead
 
-    text = "\n".join(text_lines)
+        attempted=False 表示没有实际发送（如目的地熔断），只记录错误，不计入尝试次数。
+        """
+        if max_attempts is None:
+            max_attempts = get_config().outbox_max_attempts
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox_deliveries SET attempts = attempts + ?, last_error = ? "
+                "WHERE idem_key = ? AND destination = ?",
+                (int(attempted), error, key, destination),
+            )
+            cursor = self.conn.execute(
+                "UPDATE outbox_deliveries SET status = 'dead', sent_at = ? "
+                "WHERE idem_key = ? AND destination = ? AND status = 'pending' "
+                "AND attempts >= ?",
+                (time.time(), key, destination, max_attempts),
+            )
+            self.conn.commit()
+        return cursor.rowcount > 0
 
-    payload = {
-        "message_type": "text",
-        "content": {
-            "total_titles": str(total_titles),
-            "timestamp": timestamp,
-            "report_type": report_type,
-            "text": text,
-        },
-    }
+    def purge_done(self, ttl_days=None):
+        """清理超过保留期的已发送和已放弃（dead）的消息，返回清理条数"""
+        if ttl_days is None:
+            ttl_days = get_config().seen_ttl_days
+        cutoff = time.time() - ttl_days * 86400
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM outbox_deliveries "
+                "WHERE status IN ('done', 'dead') AND sent_at < ?",
+                (cutoff,),
+            )
+            cursor = self.conn.execute(
+                "DELETE FROM outbox WHERE created_at < ? AND NOT EXISTS "
+                "(SELECT 1 FROM outbox_deliveries d WHERE d.idem_key = outbox.idem_key)",
+                (cutoff,),
+            )
+            self.conn.commit()
+        return cursor.rowcount
 
-    try:
-        logger.info(f"正在发送 {report_type} 消息到飞书...")
-        response = requests.post(FEISHU_WEBHOOK, json=payload, timeout=10)
-        response.raise_for_status()
+    def close(self):
+        self.conn.close()
+
+
+def enqueue_messages(outbox, messages, routes):
+    """把消息 [(幂等键, 描述, payload)] 及其目的地 {幂等键: [目的地]} 写入 outbox，返回消息的键"""
+    for key, description, _ in messages:
+        if not routes[key]:
+            logger.warning(f"{description}没有匹配的推送目的地")
+    outbox.add(messages, routes)
+    return [key for key, _, _ in messages]
 
-        result = response.json()
-        logger.info(f"✅ 成功发送 {report_type} 消息到飞书，响应: {result}")
+
+def deliver_outbox(outbox, keys=None):
+    """把 outbox 中未送达的投递（可以只发送指定的消息）并发发往各目的地，全部送达时返回 True"""
+    deliveries = outbox.pending(keys)
+    if not deliveries:
         return True
-    except requests.exceptions.Timeout:
-        logger.error(f"❌ 发送 {report_type} 消息超时")
-        return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ 发送 {report_type} 消息失败: {str(e)}")
+    sinks = get_sinks()
+    if not sinks:
+        logger.error("没有配置推送目的地（FEISHU_WEBHOOK 或 destinations.json）")
         return False
-    except Exception as e:
+
+    destinations = {destination for _, destination, _, _ in deliveries}
+    logger.info(f"正在发送 {len(deliveries)} 条消息到 {len(destinations)} 个目的地...")
+    pool = SenderPool(sinks)
+    results = pool.deliver(deliveries)
+    descriptions = {
+        (key, destination): description
+        for key, destination, description, _ in deliveries
+    }
+    failed = dead = 0
+    for (key, destination), error in results.items():
+        if error is None:
+            outbox.mark_done(key, destination)
+            continue
+        failed += 1
+        attempted = (key, destination) not in pool.skipped
+        if outbox.mark_failed(key, destination, error, attempted):
+            dead += 1
+            logger.error(
+                f"❌ {descriptions[(key, destination)]}发往 {destination} 已失败 "
+                f"{get_config().outbox_max_attempts} 次（{error}），不再补发"
+            )
+            metrics.inc("fda_deliveries_dead_total", destination=destination)
+
+    if failed:
         logger.error(
-            f"❌ 发送 {report_type} 消息时发生未知错误: {str(e)}", exc_info=True
+            f"❌ 共 {len(deliveries)} 条消息，{failed} 条发送失败，"
+            f"{failed - dead} 条将在下次运行时补发"
         )
         return False
+    return True
 
 
 def send_error_notification(error_message):
-    """发送错误通知到飞书"""
-    if not FEISHU_WEBHOOK:
+    """发送错误通知到接收 errors 类别的目的地"""
+    if not get_sinks():
         return
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -435,11 +3192,445 @@ def send_error_notification(error_message):
         },
     }
 
+    key = Outbox.make_key("errors", timestamp, error_message)
+    if deliver_messages([(key, "错误通知", payload)], "errors"):
+        logger.info("已发送错误通知")
+
+
+class ReportJob:
+    """摄取流水线中一个端点的处理任务，各阶段依次填充其中的数据
+
+    获取阶段把记录按 RecordBatch 分批交给去重阶段，去重阶段只在 new_results 中保留
+    推送上限以内的新记录，最后一批处理完后再把任务交给格式化阶段。
+    """
+
+    def __init__(self, endpoint_type, report_name, meta=None):
+        self.endpoint_type = endpoint_type
+        self.report_name = report_name
+        self.meta = meta if meta is not None else {}
+        self.new_results = []
+        self.new_ids = set()
+        self.fetched = 0
+        self.archived = 0
+        self.skipped = 0
+        self.deferred = 0
+        # 格式化后的消息及其目的地 {幂等键: [目的地]}
+        self.messages = None
+        self.routes = None
+        # 已交给去重阶段、还没有处理完的批次数，以及获取阶段是否已结束
+        self.pending_batches = 0
+        self.fetch_done = False
+        self.lock = threading.Lock()
+        # 处理结果：True 成功、False 失败、None 没有新数据需要推送
+        self.ok = None
+        self.error = None
+
+    def fail(self, error):
+        self.ok = False
+        self.error = error
+
+
+class RecordBatch:
+    """获取阶段交给去重阶段的一批记录"""
+
+    def __init__(self, job, results):
+        self.job = job
+        self.results = results
+        self.report_name = job.report_name
+
+    def fail(self, error):
+        self.job.fail(error)
+
+
+class ArchiveWriter:
+    """归档写入线程 - 去重阶段把批次交给它后立即继续，归档不再占用单线程的去重阶段
+
+    写入线程每次取出队列中已有的全部批次，用 RecordArchive.add_batches 在一个事务中
+    写入，归档跟不上时批次越积越多、提交次数随之减少。队列有界，积压超过容量时
+    submit 会等待。归档失败只记录警告，不影响推送。close() 等待全部批次写完。
+    """
+
+    def __init__(self, archive, queue_size=PIPELINE_QUEUE_SIZE):
+        import queue
+
+        self.archive = archive
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name="archive", daemon=True)
+        self.thread.start()
+
+    def submit(self, job, results):
+        """提交一批待归档的记录，写入条数会累加到 job.archived"""
+        self.queue.put((job, results))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        import queue
+
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batches = [item for item in items if item is not None]
+            if batches:
+                self._write(batches)
+            if len(batches) < len(items):
+                return
+
+    def _write(self, batches):
+        try:
+            with metrics.timer("fda_archive_seconds"):
+                counts = self.archive.add_batches(
+                    [(job.endpoint_type, results) for job, results in batches]
+                )
+        except Exception as e:
+            for name in dict.fromkeys(job.report_name for job, _ in batches):
+                logger.warning(f"{name}: 归档记录失败: {str(e)}")
+            return
+        metrics.inc("fda_archive_commits_total")
+        for (job, _), count in zip(batches, counts):
+            with job.lock:
+                job.archived += count
+
+
+class Pipeline:
+    """多阶段流水线 - 每个阶段由若干工作线程处理，相邻阶段之间用有界队列连接
+
+    stages 为 [(阶段名称, 处理函数, 线程数)]。处理函数接收一个任务，返回 True 时把该任务
+    交给下一阶段，返回 False 时任务结束（失败或没有新数据），返回可迭代对象时把其中的
+    每一项依次交给下一阶段（如把一个端点拆成多个批次）；抛出异常时任务记为失败。
+    下游处理不过来时队列被填满，上游阶段在 put 处等待，在途的项数不超过各阶段线程数与
+    队列容量之和。各阶段的处理耗时和等待下游的耗时记录在 fda_pipeline_*_seconds 中。
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, jobs):
+        """处理全部任务，返回任务列表（顺序与输入相同，处理结果在各任务中）"""
+        import queue
+
+        jobs = list(jobs)
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+
+        def work(index):
+            name, func, _ = self.stages[index]
+            inbox = queues[index]
+            downstream = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                job = inbox.get()
+                if job is None:
+                    return
+                start = time.perf_counter()
+                blocked = 0.0
+                try:
+                    forward = func(job)
+                    if forward is True:
+                        forward = [job]
+                    for item in forward or ():
+                        if downstream is None:
+                            continue
+                        put_start = time.perf_counter()
+                        downstream.put(item)
+                        blocked += time.perf_counter() - put_start
+                except Exception as e:
+                    job.fail(f"{job.report_name}: {str(e)}")
+                    logger.error(
+                        f"处理 {job.report_name} 时发生错误: {str(e)}", exc_info=True
+                    )
+                elapsed = time.perf_counter() - start
+                metrics.observe(
+                    "fda_pipeline_stage_seconds", elapsed - blocked, stage=name
+                )
+                metrics.observe("fda_pipeline_blocked_seconds", blocked, stage=name)
+
+        threads = []
+        for index, (name, _, workers) in enumerate(self.stages):
+            stage_threads = [
+                threading.Thread(
+                    target=work, args=(index,), name=f"{name}-{n}", daemon=True
+                )
+                for n in range(max(1, workers))
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        for job in jobs:
+            queues[0].put(job)
+        # 一个阶段的线程全部退出后，下游不会再收到新任务，再通知下一阶段退出
+        for inbox, stage_threads in zip(queues, threads):
+            for _ in stage_threads:
+                inbox.put(None)
+            for thread in stage_threads:
+                thread.join()
+        return jobs
+
+
+def fetch_job(job, days=None, limit=None, batch_size=None):
+    """获取阶段：流式下载并解析端点数据，按 batch_size 条一批产出 RecordBatch
+
+    每条记录投影为提取器需要的字段，整个端点的记录不会同时保存在内存中。最后总会产出
+    一个（可能为空的）结束批次，由去重阶段在全部批次处理完后把任务交给格式化阶段。
+    获取失败时任务记为失败，已产出的批次照常归档，但不会推送。
+    """
+    config = get_config()
+    days = config.fetch_days if days is None else days
+    limit = config.fetch_limit if limit is None else limit
+    batch_size = batch_size or PIPELINE_BATCH_SIZE
+    endpoint_type = job.endpoint_type
+    elapsed = 0.0
+    try:
+        records = iter_recent_fda_records(endpoint_type, days, limit, job.meta)
+        while True:
+            start = time.perf_counter()
+            batch = list(itertools.islice(records, batch_size))
+            elapsed += time.perf_counter() - start
+            if not batch:
+                break
+            job.fetched += len(batch)
+            with job.lock:
+                job.pending_batches += 1
+            yield RecordBatch(job, batch)
+        total = job.meta.get("results", {}).get("total", job.fetched)
+        logger.info(
+            f"成功获取 {endpoint_type} 数据，共 {job.fetched} 条记录"
+            f"（最近 {days} 天共 {total} 条）"
+        )
+    except Exception as e:
+        logger.error(f"获取 {endpoint_type} 数据失败: {str(e)}", exc_info=True)
+        job.fail(f"{job.report_name}: 获取数据失败")
+    finally:
+        metrics.observe("fda_fetch_seconds", elapsed, endpoint=endpoint_type)
+        metrics.inc("fda_records_fetched_total", job.fetched, endpoint=endpoint_type)
+
+    with job.lock:
+        job.pending_batches += 1
+        job.fetch_done = True
+    yield RecordBatch(job, [])
+
+
+def dedupe_batch(batch, seen_store, archive_writer=None):
+    """去重阶段：把一批记录交给归档线程，过滤掉之前已经推送过的，新记录在推送上限内收集到任务中
+
+    端点的最后一批处理完后返回 [任务]，交给格式化阶段。
+    """
+    job = batch.job
+    report_name, endpoint_type = job.report_name, job.endpoint_type
+    results = batch.results
     try:
-        requests.post(FEISHU_WEBHOOK, json=payload, timeout=10)
-        logger.info("已发送错误通知到飞书")
+        if archive_writer and results:
+            archive_writer.submit(job, results)
+
+        if not results:
+            new_results = []
+        else:
+            with metrics.timer("fda_dedupe_seconds", endpoint=endpoint_type):
+                new_results = seen_store.filter_new(endpoint_type, results)
+        limit = get_config().max_push_records
+        with job.lock:
+            job.skipped += len(results) - len(new_results)
+            for item in new_results:
+                record_id = get_record_id(endpoint_type, item)
+                if record_id and record_id in job.new_ids:
+                    job.skipped += 1  # 同一记录出现在多个批次中
+                    continue
+                # 只推送（并在发送阶段标记）上限以内的记录，超出上限的留到下次运行
+                if len(job.new_results) >= limit:
+                    job.deferred += 1
+                    continue
+                if record_id:
+                    job.new_ids.add(record_id)
+                job.new_results.append(item)
     except Exception as e:
-        logger.error(f"发送错误通知失败: {str(e)}")
+        # 在释放批次计数之前标记失败，其他线程收尾时不会继续推送
+        job.fail(f"{report_name}: {str(e)}")
+        raise
+    finally:
+        with job.lock:
+            job.pending_batches -= 1
+            complete = job.fetch_done and job.pending_batches == 0
+    if complete and _finish_dedupe(job):
+        return [job]
+    return False
+
+
+def _finish_dedupe(job):
+    """端点的全部批次去重完成后记录日志，返回是否有新记录需要继续处理"""
+    report_name = job.report_name
+    if job.ok is False:
+        return False
+    if job.skipped:
+        logger.info(f"{report_name}: 跳过 {job.skipped} 条已推送记录")
+    if job.deferred:
+        logger.info(
+            f"{report_name}: 新记录 {len(job.new_results) + job.deferred} 条，"
+            f"本次推送 {len(job.new_results)} 条，其余留到下次"
+        )
+    if not job.new_results:
+        logger.info(f"{report_name}: 无新数据需要推送")
+        return False
+    return True
+
+
+def build_record_messages(endpoint_type, report_name, data, timestamp):
+    """渲染端点的新记录并按目的地路由，为每组目的地打包消息，返回 (消息列表, 路由)
+
+    每条记录只渲染一次；每个目的地的消息只包含它接收的记录，序号也按这些记录重新编排。
+    """
+    total_titles = str(get_result_total(data))
+    _, rendered = _render_results(data, report_name)
+    if not rendered:
+        return [], {}
+    results = data["results"][: len(rendered)]
+    messages = {id(item): message for item, (_, message, _) in zip(results, rendered)}
+
+    def build(group):
+        record_texts = number_record_texts([messages[id(item)] for item in group])
+        return build_feishu_messages(
+            total_titles=total_titles,
+            timestamp=timestamp,
+            report_type=report_name,
+            record_texts=record_texts,
+            pushed=len(record_texts),
+        )
+
+    return build_routed_messages(route_records(endpoint_type, results), build)
+
+
+def format_job(job, timestamp):
+    """格式化阶段：按目的地路由新记录，渲染并打包为待发送的消息"""
+    endpoint_type, report_name = job.endpoint_type, job.report_name
+    if not job.new_results:
+        logger.info(f"{report_name}: 无新数据需要推送")
+        return False
+    data = {"meta": job.meta, "results": job.new_results}
+    with metrics.timer("fda_format_seconds", endpoint=endpoint_type):
+        job.messages, job.routes = build_record_messages(
+            endpoint_type, report_name, data, timestamp
+        )
+    metrics.inc(
+        "fda_records_pushed_total", len(job.new_results), endpoint=endpoint_type
+    )
+    if not job.messages:
+        logger.warning(f"{report_name}: {len(job.new_results)} 条新记录没有匹配的推送目的地")
+    return True
+
+
+def deliver_job(job, seen_store, outbox):
+    """发送阶段：先写入 outbox 再发送，写入后由 outbox 保证送达"""
+    keys = enqueue_messages(outbox, job.messages, job.routes)
+    seen_store.mark_seen(job.endpoint_type, job.new_results)
+    if deliver_outbox(outbox, keys):
+        job.ok = True
+    else:
+        job.fail(f"{job.report_name}: 发送失败（已保存，下次运行时补发）")
+    return True
+
+
+def build_ingest_pipeline(seen_store, outbox, archive_writer=None, timestamp=None):
+    """按配置的线程数和队列容量构建 获取 → 去重 → 格式化 → 发送 流水线
+
+    去重阶段把记录交给 archive_writer（ArchiveWriter），归档在单独的线程中进行。
+    """
+    config = get_config()
+    workers = config.pipeline_workers
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return Pipeline(
+        [
+            ("fetch", fetch_job, workers["fetch"]),
+            (
+                "dedupe",
+                lambda batch: dedupe_batch(batch, seen_store, archive_writer),
+                workers["dedupe"],
+            ),
+            ("format", lambda job: format_job(job, timestamp), workers["format"]),
+            (
+                "deliver",
+                lambda job: deliver_job(job, seen_store, outbox),
+                workers["deliver"],
+            ),
+        ],
+        config.pipeline_queue_size,
+    )
+
+
+def run_cycle(report_types, seen_store, outbox, archive=None):
+    """执行一轮获取和推送：先补发未送达的消息，再让各端点的任务流过摄取流水线，
+    不良事件（SIGNAL_ENDPOINT）有新归档的记录时随后检测并推送安全信号
+
+    返回 (成功数, 失败数, 错误列表)。
+    """
+    success_count = 0
+    fail_count = 0
+    errors = []
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 先补发上次运行未送达的消息
+    pending = outbox.pending()
+    if pending:
+        logger.info(f"📮 补发 {len(pending)} 条上次未送达的消息...")
+        if not deliver_outbox(outbox):
+            fail_count += 1
+            errors.append("补发上次未送达的消息失败")
+
+    workers = get_config().pipeline_workers
+    logger.info(
+        f"📡 正在处理 {len(report_types)} 个端点的数据（各阶段线程数: "
+        + "，".join(f"{stage} {count}" for stage, count in workers.items())
+        + "）..."
+    )
+    cycle_start = time.perf_counter()
+    archive_writer = ArchiveWriter(archive) if archive else None
+    pipeline = build_ingest_pipeline(seen_store, outbox, archive_writer, timestamp)
+    try:
+        jobs = pipeline.run(
+            ReportJob(endpoint_type, report_name)
+            for endpoint_type, report_name in report_types
+        )
+    finally:
+        if archive_writer:
+            archive_writer.close()
+    for job in jobs:
+        if job.archived:
+            logger.info(f"{job.report_name}: 已归档 {job.archived} 条记录")
+        if job.ok:
+            success_count += 1
+        elif job.ok is False:
+            fail_count += 1
+            errors.append(job.error)
+
+    # 不良事件归档有更新时，基于最新的归档检测并推送新的安全信号
+    if archive and any(
+        job.endpoint_type == SIGNAL_ENDPOINT and job.archived for job in jobs
+    ):
+        try:
+            signals_ok = push_new_signals(archive, outbox)
+        except Exception as e:
+            logger.error(f"安全信号检测失败: {str(e)}", exc_info=True)
+            signals_ok = False
+        if not signals_ok:
+            fail_count += 1
+            errors.append("药品安全信号: 推送失败")
+
+    metrics.observe("fda_cycle_seconds", time.perf_counter() - cycle_start)
+    metrics.set("fda_last_cycle_timestamp_seconds", round(time.time(), 3))
+    metrics.set("fda_last_cycle_failures", fail_count)
+    return success_count, fail_count, errors
+
+
+def purge_state(seen_store, outbox):
+    """清理过期的去重记录和已发送消息"""
+    purged = seen_store.purge_expired()
+    if purged:
+        logger.info(f"已清理 {purged} 条过期的去重记录")
+    outbox.purge_done()
 
 
 def main():
@@ -449,54 +3640,22 @@ def main():
     logger.info(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 60)
 
-    success_count = 0
-    fail_count = 0
-    errors = []
+    seen_store = None
+    outbox = None
+    archive = None
+    started_at = datetime.now()
+    report = {"command": "run", "started_at": started_at.isoformat(timespec="seconds")}
 
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # 定义要获取的数据类型 - 先获取容易成功的
-        report_types = [
-            ("label", "药品标签"),
-            ("drugs", "药品不良事件"),
-            ("enforcement", "警告信"),
-        ]
-
-        for endpoint_type, report_name in report_types:
-            logger.info(f"\n{'='*40}")
-            logger.info(f"📡 正在处理 {report_name} 数据...")
-            logger.info(f"{'='*40}")
+        seen_store = SeenStore()
+        outbox = Outbox()
+        archive = RecordArchive()
+        purge_state(seen_store, outbox)
 
-            try:
-                data = get_recent_fda_data(endpoint_type)
-
-                if data:
-                    content_blocks = format_message_with_links(data, report_name)
-                    if content_blocks:
-                        total = len(data.get("results", []))
-                        if send_to_feishu_rich(
-                            total_titles=str(total),
-                            timestamp=timestamp,
-                            report_type=report_name,
-                            content_blocks=content_blocks,
-                        ):
-                            success_count += 1
-                        else:
-                            fail_count += 1
-                            errors.append(f"{report_name}: 发送失败")
-                    else:
-                        logger.info(f"{report_name}: 无新数据需要推送")
-                else:
-                    fail_count += 1
-                    error_msg = f"{report_name}: 获取数据失败"
-                    errors.append(error_msg)
-                    logger.warning(error_msg)
-            except Exception as e:
-                fail_count += 1
-                error_msg = f"{report_name}: {str(e)}"
-                errors.append(error_msg)
-                logger.error(f"处理 {report_name} 时发生错误: {str(e)}", exc_info=True)
+        success_count, fail_count, errors = run_cycle(
+            REPORT_TYPES, seen_store, outbox, archive
+        )
+        report.update(success=success_count, failed=fail_count, errors=errors)
 
         # 输出执行摘要
         logger.info("\n" + "=" * 60)
@@ -521,8 +3680,547 @@ def main():
     except Exception as e:
         logger.critical(f"任务执行过程中发生严重错误: {str(e)}", exc_info=True)
         send_error_notification(f"任务执行失败: {str(e)}")
+        report["errors"] = [f"任务执行失败: {str(e)}"]
         raise
+    finally:
+        if seen_store:
+            seen_store.close()
+        if outbox:
+            outbox.close()
+        if archive:
+            archive.close()
+        report["duration_seconds"] = round(
+            (datetime.now() - started_at).total_seconds(), 3
+        )
+        try:
+            write_run_report(report)
+        except OSError as e:
+            logger.warning(f"写入运行报告失败: {str(e)}")
+
+
+def serve():
+    """守护模式：常驻进程，各端点按自己的间隔轮询，复用连接池和缓存，收到 SIGTERM 后退出
+
+    每天到达 digest_hour 后的第一次循环发送一次数据摘要。
+    """
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，完成当前任务后退出...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    logger.info("=" * 60)
+    logger.info("🚀 FDA 数据推送守护进程已启动")
+    config = get_config()
+    poll_intervals = config.poll_intervals
+    for endpoint_type, report_name in REPORT_TYPES:
+        logger.info(f"  {report_name}: 每 {poll_intervals[endpoint_type]} 秒轮询一次")
+    logger.info("=" * 60)
+
+    # 缓存有效期不能超过最短的轮询间隔，否则轮询会一直命中旧的缓存
+    cache = get_response_cache()
+    cache.ttl = min(cache.ttl, min(poll_intervals.values()))
+
+    metrics_server = (
+        start_metrics_server(config.metrics_port) if config.metrics_port else None
+    )
+    started_at = datetime.now()
+    report_names = dict(REPORT_TYPES)
+    seen_store = SeenStore()
+    outbox = Outbox()
+    archive = RecordArchive()
+    now = time.monotonic()
+    next_run = {endpoint_type: now for endpoint_type in report_names}
+    next_purge = now
+    last_digest = None
+
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_purge:
+                purge_state(seen_store, outbox)
+                next_purge = now + 86400
+
+            today = datetime.now()
+            if (
+                config.digest_hour >= 0
+                and today.hour >= config.digest_hour
+                and last_digest != today.date()
+            ):
+                # 失败时当天不再重试，已生成的消息由 outbox 补发
+                last_digest = today.date()
+                try:
+                    if not send_digest(outbox):
+                        send_error_notification("数据摘要推送失败")
+                except Exception as e:
+                    logger.error(f"发送数据摘要时发生错误: {str(e)}", exc_info=True)
+                    send_error_notification(f"数据摘要推送失败: {str(e)}")
+
+            due = [
+                (endpoint_type, report_names[endpoint_type])
+                for endpoint_type, run_at in next_run.items()
+                if run_at <= now
+            ]
+            if not due:
+                stop_event.wait(min(next_run.values()) - now)
+                continue
+
+            try:
+                _, fail_count, errors = run_cycle(due, seen_store, outbox, archive)
+                if fail_count > 0:
+                    send_error_notification("\n".join(errors))
+            except Exception as e:
+                logger.error(f"轮询过程中发生错误: {str(e)}", exc_info=True)
+                send_error_notification(f"轮询失败: {str(e)}")
+
+            finished = time.monotonic()
+            for endpoint_type, _ in due:
+                next_run[endpoint_type] = finished + poll_intervals[endpoint_type]
+    finally:
+        seen_store.close()
+        outbox.close()
+        archive.close()
+        close_http_session()
+        if metrics_server:
+            metrics_server.shutdown()
+        write_run_report(
+            {
+                "command": "serve",
+                "started_at": started_at.isoformat(timespec="seconds"),
+                "duration_seconds": round(
+                    (datetime.now() - started_at).total_seconds(), 3
+                ),
+            }
+        )
+        logger.info("👋 守护进程已退出")
+
+
+def compute_signals(
+    total,
+    drug_counts,
+    reaction_counts,
+    pair_counts,
+    prr_threshold=None,
+    chi2_threshold=None,
+):
+    """按 2x2 列联表计算每个药品×反应组合的 PRR、ROR（含 95% 置信区间）和 Yates 卡方
+
+    a: 同时包含该药品和反应的报告数，b: 含该药品不含该反应，
+    c: 含该反应不含该药品，d: 其余报告。返回达到阈值的信号，按 PRR 降序。
+    阈值默认使用配置中的 signal_prr_threshold 和 signal_chi2_threshold。
+    """
+    config = get_config()
+    if prr_threshold is None:
+        prr_threshold = config.signal_prr_threshold
+    if chi2_threshold is None:
+        chi2_threshold = config.signal_chi2_threshold
+    signals = []
+    for drug, reaction, count in pair_counts:
+        a = count
+        b = drug_counts[drug] - a
+        c = reaction_counts[reaction] - a
+        d = total - a - b - c
+        if d < 0:
+            # 计数不一致（如统计期间数据变化），无法构成列联表
+            continue
+        if 0 in (b, c, d):
+            # 有空单元格时使用 Haldane 校正（每格加 0.5）。c 为 0 即该反应只出现在
+            # 该药品的报告中，是最强的信号，不能跳过
+            a, b, c, d = a + 0.5, b + 0.5, c + 0.5, d + 0.5
+        n = a + b + c + d
+        prr = (a / (a + b)) / (c / (c + d))
+        chi2 = (
+            n
+            * max(0.0, abs(a * d - b * c) - n / 2) ** 2
+            / ((a + b) * (c + d) * (a + c) * (b + d))
+        )
+        if prr < prr_threshold or chi2 < chi2_threshold:
+            continue
+        ror = (a * d) / (b * c)
+        se = math.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+        signals.append(
+            {
+                "drug": drug,
+                "reaction": reaction,
+                "count": count,
+                "prr": round(prr, 2),
+                "ror": round(ror, 2),
+                "ror_ci": (
+                    round(math.exp(math.log(ror) - 1.96 * se), 2),
+                    round(math.exp(math.log(ror) + 1.96 * se), 2),
+                ),
+                "chi2": round(chi2, 1),
+            }
+        )
+    signals.sort(key=lambda entry: (-entry["prr"], -entry["count"]))
+    return signals
+
+
+def detect_signals(archive, days=None, min_count=None):
+    """基于本地归档检测最近 days 天的不良事件安全信号"""
+    config = get_config()
+    days = config.signal_days if days is None else days
+    min_count = config.signal_min_count if min_count is None else min_count
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    total, drug_counts, reaction_counts, pair_counts = archive.signal_counts(
+        since, min_count
+    )
+    logger.info(
+        f"信号检测：最近 {days} 天共 {total} 份报告，{len(pair_counts)} 个组合达到最少报告数"
+    )
+    if not total:
+        return []
+    return compute_signals(total, drug_counts, reaction_counts, pair_counts)
+
+
+def push_new_signals(archive, outbox, days=None):
+    """检测安全信号，只推送之前没有推送过的，返回是否成功"""
+    report_name = "药品安全信号"
+    signals = archive.filter_new_signals(detect_signals(archive, days))
+    if not signals:
+        logger.info(f"{report_name}: 没有新的信号")
+        return True
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    total = len(signals)
+    signals = signals[: get_config().max_push_records]
+
+    def build(entries):
+        record_texts = []
+        for i, entry in enumerate(entries, 1):
+            low, high = entry["ror_ci"]
+            record_texts.append(
+                f"{i}. {entry['drug']} × {entry['reaction']}\n"
+                f"\n   PRR: {entry['prr']}  ROR: {entry['ror']} "
+                f"(95% CI {low}-{high})  报告数: {entry['count']}"
+            )
+        return build_feishu_messages(str(total), timestamp, report_name, record_texts)
+
+    # 目的地的关注列表匹配信号中的药品名和不良反应
+    messages, routes = build_routed_messages(
+        route_records(
+            "signals", signals, text=lambda entry: f"{entry['drug']}\n{entry['reaction']}"
+        ),
+        build,
+    )
+    # 只标记本次推送的信号，超出推送上限的留到下次
+    keys = enqueue_messages(outbox, messages, routes)
+    archive.mark_signals(signals)
+    return deliver_outbox(outbox, keys)
+
+
+def build_digest(days=None, report_types=REPORT_TYPES):
+    """用 count= 聚合查询生成各端点的数据摘要，返回 (各端点的摘要文本, 记录总数)
+
+    每个端点只需 1 个总数查询和每个统计字段 1 个 count 查询，不需要下载记录。
+    查询失败的端点会被跳过。
+    """
+    days = get_config().fetch_days if days is None else days
+    sections = []
+    grand_total = 0
+    for endpoint_type, report_name in report_types:
+        try:
+            extractor = EXTRACTORS[endpoint_type]
+            total = get_fda_total(endpoint_type, days)
+            grand_total += total
+            lines = [f"{extractor.emoji} {report_name}: 共 {total} 条"]
+            for count_field in extractor.spec.get("count_fields", []):
+                counts = get_fda_counts(endpoint_type, count_field["field"], days)
+                if counts:
+                    top = "，".join(f"{term} ({count})" for term, count in counts)
+                    lines.append(f"   {count_field['label']}: {top}")
+            sections.append("\n".join(lines))
+        except Exception as e:
+            logger.error(f"生成 {report_name} 摘要失败: {str(e)}", exc_info=True)
+    return sections, grand_total
+
+
+def send_digest(outbox, days=None):
+    """生成并推送数据摘要，返回是否成功"""
+    days = get_config().fetch_days if days is None else days
+    sections, grand_total = build_digest(days)
+    if not sections:
+        logger.error("数据摘要为空，所有端点的统计查询都失败了")
+        return False
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    # 摘要的数字可能与之前某天完全相同，幂等键带上日期，每天的摘要都会推送
+    messages, routes = build_routed_messages(
+        route_records("digest", sections, text=str),
+        lambda sections: build_feishu_messages(
+            str(grand_total),
+            timestamp,
+            f"数据摘要（最近 {days} 天）",
+            sections,
+            key_scope=now.strftime("%Y-%m-%d"),
+        ),
+    )
+    return deliver_outbox(outbox, enqueue_messages(outbox, messages, routes))
+
+
+def backfill_archive(days, report_types=REPORT_TYPES):
+    """把最近 days 天窗口内的全部记录写入本地归档（不推送）"""
+    archive = RecordArchive()
+    try:
+        for endpoint_type, report_name in report_types:
+            total = 0
+            batch = []
+            for item in iter_fda_records(endpoint_type, days=days):
+                batch.append(item)
+                if len(batch) >= PAGE_SIZE:
+                    total += archive.add(endpoint_type, batch)
+                    batch = []
+            if batch:
+                total += archive.add(endpoint_type, batch)
+            logger.info(f"{report_name}: 已归档最近 {days} 天的 {total} 条记录")
+    finally:
+        archive.close()
+
+
+def read_json_input(path=None):
+    """读取 JSON 输入，path 为空或 "-" 时从标准输入读取"""
+    if not path or path == "-":
+        return json.load(sys.stdin)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_output(data, path=None):
+    """写出 JSON，path 为空或 "-" 时写到标准输出（日志在标准错误，便于用管道串联各阶段）"""
+    if not path or path == "-":
+        json.dump(data, sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def fetch_stage(output=None, report_types=REPORT_TYPES):
+    """fetch 阶段：并发获取各端点数据，写出 {endpoint_type: data}，获取失败的端点为 null
+
+    返回是否全部获取成功。
+    """
+    fetched = fetch_all_fda_data(report_types)
+    failed = 0
+    for endpoint_type, data in fetched.items():
+        if isinstance(data, Exception):
+            logger.error(f"获取 {endpoint_type} 数据失败: {str(data)}")
+            fetched[endpoint_type] = data = None
+        if data is None:
+            failed += 1
+    write_json_output(fetched, output)
+    return failed == 0
+
+
+def format_stage(input_path=None, output=None):
+    """format 阶段：把 fetch 阶段的输出按目的地路由并格式化为待发送的消息
+    [{key, category, destinations, description, payload}]
+
+    与 run 不同，这里不归档也不去重；消息的幂等键与 run 生成的相同，已推送过的
+    记录在 send 阶段会被 outbox 忽略。返回是否成功。
+    """
+    fetched = read_json_input(input_path)
+    report_names = dict(REPORT_TYPES)
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    messages = []
+    for endpoint_type, data in fetched.items():
+        report_name = report_names.get(endpoint_type)
+        if not report_name:
+            logger.warning(f"未知的端点类型: {endpoint_type}")
+            continue
+        if not data or not data.get("results"):
+            continue
+        results = data["results"][: get_config().max_push_records]
+        with metrics.timer("fda_format_seconds", endpoint=endpoint_type):
+            endpoint_messages, routes = build_record_messages(
+                endpoint_type, report_name, {**data, "results": results}, timestamp
+            )
+        messages.extend(
+            {
+                "key": key,
+                "category": endpoint_type,
+                "destinations": routes[key],
+                "description": description,
+                "payload": payload,
+            }
+            for key, description, payload in endpoint_messages
+        )
+    write_json_output(messages, output)
+    logger.info(f"共格式化 {len(messages)} 条消息")
+    return True
+
+
+def send_stage(input_path=None):
+    """send 阶段：把 format 阶段输出的消息写入 outbox 并发往其目的地，返回是否全部送达
+
+    没有 destinations 字段的消息（旧版本的输出）按类别路由。
+    """
+    messages = []
+    routes = {}
+    for message in read_json_input(input_path):
+        entry = (message["key"], message["description"], message["payload"])
+        messages.append(entry)
+        if "destinations" in message:
+            routes[message["key"]] = message["destinations"]
+        else:
+            routes.update(route_messages([entry], message.get("category")))
+    outbox = Outbox()
+    try:
+        return deliver_outbox(outbox, enqueue_messages(outbox, messages, routes))
+    finally:
+        outbox.close()
+
+
+def run_stage(command, func, *args):
+    """执行 fetch / format / send 中的一个阶段，记录耗时并写入运行报告，返回是否成功"""
+    started_at = datetime.now()
+    start = time.perf_counter()
+    ok = False
+    try:
+        ok = func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("fda_stage_seconds", elapsed, stage=command)
+        logger.info(f"{command} 阶段耗时 {elapsed:.3f} 秒")
+        try:
+            write_run_report(
+                {
+                    "command": command,
+                    "started_at": started_at.isoformat(timespec="seconds"),
+                    "success": ok,
+                    "duration_seconds": round(elapsed, 3),
+                }
+            )
+        except OSError as e:
+            logger.warning(f"写入运行报告失败: {str(e)}")
+    return ok
+
+
+def cli(argv=None):
+    """命令行入口，返回退出状态"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FDA 数据飞书推送")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=[
+            "run",
+            "fetch",
+            "format",
+            "send",
+            "serve",
+            "archive",
+            "query",
+            "signals",
+            "digest",
+        ],
+        default="run",
+        help=(
+            "run: 执行一次获取和推送（默认）；fetch / format / send: 单独执行获取、"
+            "格式化、发送阶段，通过 --input / --output 或管道传递数据；"
+            "serve: 以守护进程方式按间隔轮询；"
+            "archive: 把最近 --days 天的全部记录写入本地归档；query: 查询本地归档；"
+            "signals: 基于本地归档检测并推送新的不良事件安全信号；"
+            "digest: 用 count 聚合查询推送最近 --days 天的数据摘要"
+        ),
+    )
+    parser.add_argument(
+        "--input", help="format / send: 读取上一阶段输出的 JSON 文件（默认标准输入）"
+    )
+    parser.add_argument(
+        "--output", help="fetch / format: 结果写入该 JSON 文件（默认标准输出）"
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        help="archive / digest / signals 的天数（默认为 FDA_FETCH_DAYS，signals 为 FDA_SIGNAL_DAYS）",
+    )
+    parser.add_argument("--endpoint", help="query: 端点类型，如 enforcement")
+    parser.add_argument("--since", help="query: 起始日期 YYYY-MM-DD")
+    parser.add_argument("--until", help="query: 结束日期 YYYY-MM-DD")
+    parser.add_argument("--name", help="query: 药品/产品名称前缀")
+    parser.add_argument(
+        "--classification",
+        help="query: 召回级别（如 'Class I'）或器械不良事件类型（如 Malfunction）",
+    )
+    parser.add_argument(
+        "--group-by",
+        choices=sorted(RecordArchive.GROUP_BY_COLUMNS),
+        help="query: 按该维度统计记录数",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve: 在该端口提供 Prometheus 指标（/metrics），默认为 FDA_METRICS_PORT",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="离线模式：只使用本地缓存的 OpenFDA 响应，不访问网络",
+    )
+    args = parser.parse_args(argv)
+
+    config = get_config()
+    if args.offline:
+        config.offline = True
+    if args.metrics_port is not None:
+        config.metrics_port = args.metrics_port
+    setup_logging()
+
+    stages = {
+        "fetch": (fetch_stage, args.output),
+        "format": (format_stage, args.input, args.output),
+        "send": (send_stage, args.input),
+    }
+    if args.command in stages:
+        func, *stage_args = stages[args.command]
+        try:
+            return 0 if run_stage(args.command, func, *stage_args) else 1
+        finally:
+            close_http_session()
+            close_response_cache()
+
+    if args.command == "serve":
+        serve()
+    elif args.command == "archive":
+        backfill_archive(args.days or config.fetch_days)
+    elif args.command == "digest":
+        outbox = Outbox()
+        try:
+            if not send_digest(outbox, args.days or config.fetch_days):
+                return 1
+        finally:
+            outbox.close()
+    elif args.command == "signals":
+        archive = RecordArchive()
+        outbox = Outbox()
+        try:
+            if not push_new_signals(archive, outbox, args.days or config.signal_days):
+                return 1
+        finally:
+            archive.close()
+            outbox.close()
+    elif args.command == "query":
+        archive = RecordArchive()
+        rows = archive.query(
+            endpoint=args.endpoint,
+            since=args.since,
+            until=args.until,
+            name=args.name,
+            classification=args.classification,
+            group_by=args.group_by,
+        )
+        archive.close()
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False))
+    else:
+        main()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def config(tmp_path):
+    """每个测试使用默认配置，不读取环境变量，状态目录放在临时目录中"""
+    config = main.Config({"FDA_DATA_DIR": str(tmp_path)})
+    main.configure(config)
+    yield config
+    main.configure(None)
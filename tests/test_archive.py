@@ -0,0 +1,59 @@
+import main
+
+
+def recall(**overrides):
+    return {
+        "recall_number": "D-0001-2024",
+        "product_description": "Metformin Extended-Release Tablets " + "x" * 120,
+        "reason_for_recall": "CGMP Deviations: NDMA impurity above the acceptable limit",
+        "report_date": "20240105",
+        "classification": "Class II",
+        "recalling_firm": "ACME Pharma",
+        **overrides,
+    }
+
+
+def test_archive_keeps_raw_field_values(tmp_path):
+    archive = main.RecordArchive(path=tmp_path / "archive.db")
+    item = recall()
+    archive.add("enforcement", [item])
+
+    (record,) = archive.query(endpoint="enforcement")
+    assert record["title"] == item["product_description"]
+    assert record["reason"] == item["reason_for_recall"]
+    assert record["classification"] == "Class II"
+    assert record["date"] == "2024-01-05"
+    assert archive.query(group_by="classification") == [("Class II", 1)]
+    assert archive.query(name="metformin")
+    archive.close()
+
+
+def test_archive_leaves_missing_values_empty(tmp_path):
+    archive = main.RecordArchive(path=tmp_path / "archive.db")
+    archive.add("enforcement", [recall(product_description="", reason_for_recall="")])
+
+    (record,) = archive.query(endpoint="enforcement")
+    assert record["title"] is None
+    assert record["reason"] is None
+    archive.close()
+
+
+def test_display_extraction_is_unchanged():
+    record = main.EXTRACTORS["enforcement"].extract(recall(reason_for_recall=""))
+    assert len(record["title"]) == 80
+    assert record["reason"] == "未说明"
+    assert record["classification"] == "Class Class II"
+
+
+def test_archive_writer_counts_archived_records(tmp_path):
+    archive = main.RecordArchive(path=tmp_path / "archive.db")
+    writer = main.ArchiveWriter(archive)
+    jobs = [main.ReportJob("enforcement", "警告信"), main.ReportJob("food_enforcement", "食品召回")]
+    for start in range(0, 30, 10):
+        for job in jobs:
+            writer.submit(job, [recall(recall_number=f"R-{i}") for i in range(start, start + 10)])
+    writer.close()
+
+    assert [job.archived for job in jobs] == [30, 30]
+    assert archive.query(group_by="endpoint") == [("enforcement", 30), ("food_enforcement", 30)]
+    archive.close()
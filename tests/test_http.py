@@ -0,0 +1,65 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import main
+
+
+class FlakySession:
+    """前几次请求抛出指定的异常，之后返回 200"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        response = requests.models.Response()
+        response.status_code = 200
+        return response
+
+
+def refused():
+    reason = NewConnectionError(None, "Failed to establish a new connection")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/hook", reason))
+
+
+def reset():
+    reason = ProtocolError("Connection aborted.", ConnectionResetError(104, "reset"))
+    return requests.exceptions.ConnectionError(reason)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(main.time, "sleep", lambda seconds: None)
+
+    def install(errors):
+        flaky = FlakySession(errors)
+        monkeypatch.setattr(main, "get_http_session", lambda: flaky)
+        return flaky
+
+    return install
+
+
+def test_post_retries_when_connection_was_never_established(session):
+    flaky = session([refused(), requests.exceptions.ConnectTimeout("connect timeout")])
+    assert main.http_request("POST", "https://example.com/hook").status_code == 200
+    assert flaky.calls == 3
+
+
+@pytest.mark.parametrize(
+    "error", [reset, lambda: requests.exceptions.ReadTimeout("read timeout")]
+)
+def test_post_does_not_retry_after_body_may_have_been_sent(session, error):
+    flaky = session([error()])
+    with pytest.raises(requests.exceptions.RequestException):
+        main.http_request("POST", "https://example.com/hook")
+    assert flaky.calls == 1
+
+
+def test_get_retries_connection_resets(session):
+    flaky = session([reset(), requests.exceptions.ReadTimeout("read timeout")])
+    assert main.http_request("GET", "https://example.com/data").status_code == 200
+    assert flaky.calls == 3
@@ -0,0 +1,53 @@
+import main
+
+
+def label_extractor():
+    return main.EXTRACTORS["label"]
+
+
+def test_new_record():
+    extractor = label_extractor()
+    assert extractor.describe_changes(("3", {}), None) == "新药品标签（版本 3）"
+    assert extractor.describe_changes(("", {}), None) == "新药品标签"
+
+
+def test_unchanged_record():
+    extractor = label_extractor()
+    hashes = {"boxed_warning": "a", "warnings": "b"}
+    assert extractor.describe_changes(("3", hashes), ("3", dict(hashes))) is None
+
+
+def test_version_change_lists_sections():
+    extractor = label_extractor()
+    previous = ("53", {"boxed_warning": "a", "warnings": "b", "precautions": "c"})
+    current = ("54", {"boxed_warning": "A", "warnings": "b", "drug_interactions": "d"})
+    assert extractor.describe_changes(current, previous) == (
+        "版本 53 → 54：修改 黑框警告；新增 药物相互作用；删除 注意事项"
+    )
+
+
+def test_version_change_without_section_changes():
+    extractor = label_extractor()
+    hashes = {"warnings": "b"}
+    assert (
+        extractor.describe_changes(("2", hashes), ("1", dict(hashes)))
+        == "版本 1 → 2：其他章节修订"
+    )
+
+
+def test_content_change_without_version_change():
+    extractor = label_extractor()
+    assert (
+        extractor.describe_changes(("1", {"warnings": "new"}), ("1", {"warnings": "old"}))
+        == "内容更新：修改 警告"
+    )
+
+
+def test_section_hashes_ignore_empty_sections():
+    extractor = label_extractor()
+    hashes = extractor.section_hashes(
+        {"boxed_warning": ["text"], "warnings": [], "precautions": None}
+    )
+    assert list(hashes) == ["boxed_warning"]
+    assert hashes == extractor.section_hashes({"boxed_warning": ["text"]})
+    assert hashes != extractor.section_hashes({"boxed_warning": ["other"]})
@@ -0,0 +1,22 @@
+import logging
+import time
+
+import main
+
+
+def test_daily_handler_switches_file_after_midnight(tmp_path):
+    handler = main.DailyFileHandler(tmp_path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    today = time.time()
+    for created, message in [(today, "today"), (today + 86400, "tomorrow")]:
+        record = logging.LogRecord("fda", logging.INFO, __file__, 1, message, None, None)
+        record.created = created
+        handler.handle(record)
+    handler.close()
+
+    files = {
+        path.name: path.read_text(encoding="utf-8") for path in tmp_path.glob("fda_*.log")
+    }
+    day = time.strftime("%Y%m%d", time.localtime(today))
+    next_day = time.strftime("%Y%m%d", time.localtime(today + 86400))
+    assert files == {f"fda_{day}.log": "today\n", f"fda_{next_day}.log": "tomorrow\n"}
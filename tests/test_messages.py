@@ -0,0 +1,27 @@
+import main
+
+
+def sizes(chunk):
+    return sum(len(text.encode("utf-8")) + 1 for text in chunk)
+
+
+def test_pack_messages_respects_byte_limit_and_order():
+    texts = [f"{i}. 记录 {'x' * (i * 4)}" for i in range(40)]
+    chunks = main.pack_messages(texts, 200)
+    assert [text for chunk in chunks for text in chunk] == texts
+    assert all(sizes(chunk) <= 200 for chunk in chunks)
+    assert len(chunks) > 1
+
+
+def test_pack_messages_truncates_oversized_record():
+    chunks = main.pack_messages(["短", "中" * 100, "尾"], 50)
+    texts = [text for chunk in chunks for text in chunk]
+    assert texts[0] == "短"
+    assert texts[1].endswith("…")
+    assert len(texts[1].encode("utf-8")) + 1 <= 50
+    assert texts[2] == "尾"
+    assert all(sizes(chunk) <= 50 for chunk in chunks)
+
+
+def test_pack_messages_empty():
+    assert main.pack_messages([], 100) == []
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import main
+
+
+def page(results, **top):
+    return json.dumps(
+        {"meta": {"results": {"total": len(results)}}, **top, "results": results},
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+
+def split(body, size):
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+RECORDS = [
+    {"safetyreportid": "1", "patient": {"drug": [{"medicinalproduct": "阿司匹林"}]}},
+    {"safetyreportid": "2", "note": 'brackets ] } [ { and "quotes"'},
+    {"safetyreportid": "3", "nested": [[1, 2], {"a": None}]},
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 1 << 20])
+def test_iter_json_results_any_chunking(size):
+    top = {}
+    results = list(main.iter_json_results(split(page(RECORDS), size), top))
+    assert results == RECORDS
+    assert top["meta"] == {"results": {"total": 3}}
+
+
+def test_iter_json_results_meta_available_at_first_record():
+    top = {}
+    records = main.iter_json_results(split(page(RECORDS), 5), top)
+    next(records)
+    assert top["meta"]["results"]["total"] == 3
+
+
+def test_iter_json_results_empty_results():
+    top = {}
+    assert list(main.iter_json_results([page([])], top)) == []
+    assert top["meta"]["results"]["total"] == 0
+
+
+def test_iter_json_results_keeps_fields_after_results():
+    body = b'{"results": [{"id": 1}], "meta": {"results": {"total": 1}}}'
+    top = {}
+    assert list(main.iter_json_results(split(body, 3), top)) == [{"id": 1}]
+    assert top["meta"]["results"]["total"] == 1
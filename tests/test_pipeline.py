@@ -0,0 +1,163 @@
+import json
+import time
+
+import pytest
+
+import main
+
+
+def recall(i):
+    return {
+        "recall_number": f"R-{i}",
+        "product_description": f"Product {i}",
+        "reason_for_recall": "contamination",
+        "report_date": "20240101",
+        "classification": "Class II",
+        "recalling_firm": "ACME",
+    }
+
+
+@pytest.fixture
+def state(tmp_path, config, monkeypatch):
+    """用文件目的地代替飞书，run_cycle 所需的本地状态放在临时目录中"""
+    destinations = tmp_path / "destinations.json"
+    destinations.write_text(
+        json.dumps([{"name": "file", "type": "file", "path": str(tmp_path / "out.jsonl")}])
+    )
+    config.destinations_file = destinations
+    config.max_push_records = 3
+    monkeypatch.setattr(main, "_sinks", None)
+    seen_store = main.SeenStore(path=tmp_path / "state.db")
+    outbox = main.Outbox(path=tmp_path / "state.db")
+    archive = main.RecordArchive(path=tmp_path / "archive.db")
+    yield seen_store, outbox, archive
+    seen_store.close()
+    outbox.close()
+    archive.close()
+
+
+def fake_records(count, delay=0.0, fail=()):
+    def records(endpoint_type, days, limit, meta):
+        meta.update({"results": {"total": count}})
+        if endpoint_type in fail:
+            raise RuntimeError("network down")
+        for i in range(count):
+            yield recall(i)
+        # 记录数是批次大小的整数倍时，最后一批产出后获取阶段才会执行到这里；
+        # 稍作停留，让去重阶段先处理完全部批次
+        time.sleep(delay)
+
+    return records
+
+
+@pytest.mark.parametrize("delay", [0.0, 0.05])
+def test_run_cycle_pushes_up_to_cap_and_defers_rest(state, monkeypatch, delay):
+    monkeypatch.setattr(main, "PIPELINE_BATCH_SIZE", 4)
+    monkeypatch.setattr(main, "iter_recent_fda_records", fake_records(12, delay))
+    seen_store, outbox, archive = state
+    report_types = [("enforcement", "警告信"), ("food_enforcement", "食品召回")]
+
+    assert main.run_cycle(report_types, seen_store, outbox, archive) == (2, 0, [])
+    for endpoint_type, _ in report_types:
+        remaining = seen_store.filter_new(
+            endpoint_type, [recall(i) for i in range(12)]
+        )
+        assert [item["recall_number"] for item in remaining] == [
+            f"R-{i}" for i in range(3, 12)
+        ]
+
+    # 超出推送上限的记录在下一轮推送
+    assert main.run_cycle(report_types, seen_store, outbox, archive) == (2, 0, [])
+    assert len(seen_store.filter_new("enforcement", [recall(i) for i in range(12)])) == 6
+
+
+def test_run_cycle_reports_fetch_failure(state, monkeypatch):
+    monkeypatch.setattr(
+        main, "iter_recent_fda_records", fake_records(5, fail={"enforcement"})
+    )
+    seen_store, outbox, archive = state
+    report_types = [("enforcement", "警告信"), ("food_enforcement", "食品召回")]
+
+    success, failed, errors = main.run_cycle(report_types, seen_store, outbox, archive)
+    assert (success, failed) == (1, 1)
+    assert errors == ["警告信: 获取数据失败"]
+
+
+def test_run_cycle_routes_each_record_to_watching_destinations(state, tmp_path, monkeypatch):
+    config = main.get_config()
+    config.destinations_file.write_text(
+        json.dumps(
+            [
+                {"name": "all", "type": "file", "path": str(tmp_path / "all.jsonl")},
+                {
+                    "name": "watch",
+                    "type": "file",
+                    "path": str(tmp_path / "watch.jsonl"),
+                    "watchlist": ["Product 1"],
+                },
+            ]
+        )
+    )
+    monkeypatch.setattr(main, "iter_recent_fda_records", fake_records(3))
+    seen_store, outbox, archive = state
+
+    assert main.run_cycle([("enforcement", "警告信")], seen_store, outbox, archive) == (1, 0, [])
+
+    def pushed(name):
+        lines = (tmp_path / f"{name}.jsonl").read_text().splitlines()
+        return "\n".join(json.loads(line)["payload"]["content"]["text"] for line in lines)
+
+    assert all(f"Product {i}" in pushed("all") for i in range(3))
+    watched = pushed("watch")
+    assert "Product 1" in watched
+    assert "Product 0" not in watched and "Product 2" not in watched
+
+
+def test_run_cycle_checks_signals_after_archiving_drug_events(state, monkeypatch):
+    def drug_events(endpoint_type, days, limit, meta):
+        meta.update({"results": {"total": 2}})
+        for i in range(2):
+            yield {
+                "safetyreportid": str(i),
+                "receivedate": "20240101",
+                "patient": {
+                    "drug": [{"medicinalproduct": "A"}],
+                    "reaction": [{"reactionmeddrapt": "R"}],
+                },
+            }
+
+    calls = []
+    monkeypatch.setattr(main, "iter_recent_fda_records", drug_events)
+    monkeypatch.setattr(
+        main, "push_new_signals", lambda archive, outbox: calls.append(archive) or True
+    )
+    seen_store, outbox, archive = state
+
+    assert main.run_cycle([("drugs", "药品不良事件")], seen_store, outbox, archive) == (1, 0, [])
+    assert calls == [archive]
+    # 没有不良事件的轮次不检测信号
+    monkeypatch.setattr(main, "iter_recent_fda_records", fake_records(2))
+    main.run_cycle([("enforcement", "警告信")], seen_store, outbox, archive)
+    assert calls == [archive]
+
+
+def test_records_are_rendered_once_for_all_destinations(state, tmp_path, monkeypatch):
+    main.get_config().destinations_file.write_text(
+        json.dumps(
+            [
+                {"name": "a", "type": "file", "path": str(tmp_path / "a.jsonl")},
+                {"name": "b", "type": "file", "path": str(tmp_path / "b.jsonl"), "watchlist": ["Product 1"]},
+            ]
+        )
+    )
+    extractor = main.EXTRACTORS["enforcement"]
+    rendered = []
+    render = extractor.render
+    monkeypatch.setattr(extractor, "render", lambda record: rendered.append(record) or render(record))
+
+    messages, routes = main.build_record_messages(
+        "enforcement", "警告信", {"meta": {}, "results": [recall(i) for i in range(3)]}, "now"
+    )
+    assert len(rendered) == 3
+    assert sorted(name for names in routes.values() for name in names) == ["a", "b"]
+    assert len(messages) == 2
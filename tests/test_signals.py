@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import main
+
+
+def test_reaction_exclusive_to_drug_is_a_signal():
+    signals = main.compute_signals(
+        100, {"A": 10, "B": 90}, {"R": 5, "S": 95}, [("A", "R", 5)]
+    )
+    assert len(signals) == 1
+    signal = signals[0]
+    assert signal["count"] == 5
+    assert signal["prr"] == 91.0
+    assert signal["ror"] == 181.0
+    low, high = signal["ror_ci"]
+    assert 1 < low < signal["ror"] < high
+
+
+def test_prr_ror_and_chi2_without_empty_cells():
+    # a=20, b=30, c=20, d=930
+    signals = main.compute_signals(1000, {"A": 50}, {"R": 40}, [("A", "R", 20)])
+    assert signals[0]["prr"] == 19.0
+    assert signals[0]["ror"] == 31.0
+    assert signals[0]["chi2"] == 167.9
+
+
+def test_thresholds_filter_weak_pairs():
+    drug_counts = {"A": 100}
+    reaction_counts = {"R": 100}
+    # PRR = (10/100) / (90/900) = 1.0
+    assert main.compute_signals(1000, drug_counts, reaction_counts, [("A", "R", 10)]) == []
+    assert main.compute_signals(
+        1000, drug_counts, reaction_counts, [("A", "R", 10)], prr_threshold=0.5,
+        chi2_threshold=0,
+    )
+
+
+def test_inconsistent_counts_are_skipped():
+    assert main.compute_signals(10, {"A": 8}, {"R": 8}, [("A", "R", 1)]) == []
+
+
+def test_sorted_by_prr_descending():
+    signals = main.compute_signals(
+        1000,
+        {"A": 20, "B": 20},
+        {"R": 30, "S": 30},
+        [("A", "R", 10), ("B", "S", 15)],
+    )
+    assert [s["drug"] for s in signals] == ["B", "A"]
+
+
+def report(report_id, drugs, reactions):
+    return {
+        "safetyreportid": report_id,
+        "receivedate": datetime.now().strftime("%Y%m%d"),
+        "patient": {
+            "drug": [{"medicinalproduct": drug} for drug in drugs],
+            "reaction": [{"reactionmeddrapt": reaction} for reaction in reactions],
+        },
+    }
+
+
+def test_signal_margins_come_from_the_same_reports(tmp_path):
+    archive = main.RecordArchive(path=tmp_path / "archive.db")
+    archive.add(
+        "drugs",
+        [
+            report("1", ["A"], ["R"]),
+            report("2", ["A", "B"], ["S"]),
+            # 只有药品或只有反应的报告不能构成组合，也不计入总数和边际
+            report("3", ["A"], []),
+            report("4", [], ["R"]),
+        ],
+    )
+    since = datetime.now().strftime("%Y-%m-%d")
+    total, drug_counts, reaction_counts, pairs = archive.signal_counts(since, min_count=1)
+    assert total == 2
+    assert drug_counts == {"A": 2, "B": 1}
+    assert reaction_counts == {"R": 1, "S": 1}
+    assert sorted(pairs) == [("A", "R", 1), ("A", "S", 1), ("B", "S", 1)]
+    archive.close()
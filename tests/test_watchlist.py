@@ -0,0 +1,78 @@
+import main
+
+
+def test_matches_case_insensitively():
+    matcher = main.WatchlistMatcher(["Aspirin"])
+    assert matcher.search("contains ASPIRIN 81mg")
+    assert not matcher.search("ibuprofen")
+
+
+def test_requires_word_boundaries():
+    matcher = main.WatchlistMatcher(["ASA"])
+    assert not matcher.search("NASAL SPRAY")
+    assert matcher.search("low-dose asa")
+    assert matcher.search("ASA")
+
+
+def test_finds_overlapping_terms():
+    matcher = main.WatchlistMatcher(["he", "she", "hers"])
+    assert set(matcher.find("she hers")) == {"she", "hers"}
+
+
+def test_finds_terms_sharing_words():
+    matcher = main.WatchlistMatcher(["acme pharma", "pharma inc"])
+    assert set(matcher.find("by acme pharma inc")) == {"acme pharma", "pharma inc"}
+    assert set(matcher.find("by pharma inc")) == {"pharma inc"}
+
+
+def test_deduplicates_and_strips_terms():
+    matcher = main.WatchlistMatcher([" Advil ", "advil", "", "12345-678"])
+    assert len(matcher) == 2
+    assert matcher.terms == ["Advil", "12345-678"]
+    assert list(matcher.find("NDC 12345-678")) == ["12345-678"]
+
+
+DRUG_NAMES = [
+    "ATORVASTATIN CALCIUM", "LISINOPRIL", "LEVOTHYROXINE SODIUM", "METFORMIN HYDROCHLORIDE",
+    "AMLODIPINE BESYLATE", "METOPROLOL SUCCINATE", "OMEPRAZOLE", "SIMVASTATIN",
+    "LOSARTAN POTASSIUM", "ALBUTEROL SULFATE", "GABAPENTIN", "HYDROCHLOROTHIAZIDE",
+    "SERTRALINE HYDROCHLORIDE", "MONTELUKAST SODIUM", "FLUTICASONE PROPIONATE",
+    "ROSUVASTATIN CALCIUM", "ESCITALOPRAM OXALATE", "PANTOPRAZOLE SODIUM",
+    "FUROSEMIDE", "TRAMADOL HYDROCHLORIDE",
+]
+
+
+def test_splits_long_watch_search_into_clauses():
+    searches = main.build_watch_searches("drugs", DRUG_NAMES)
+    assert len(searches) > 1
+    assert all(len(search) <= main.WATCHLIST_SEARCH_MAX_CHARS for search in searches)
+    for name in DRUG_NAMES:
+        # 同一关注词的各字段条件在同一条查询中
+        (search,) = [search for search in searches if f'"{name}"' in search]
+        assert search.count(f'"{name}"') == len(main.RECORD_SPECS["drugs"]["watch"])
+
+
+def test_watch_search_queries_each_clause_once(monkeypatch):
+    searches = main.build_watch_searches("drugs", DRUG_NAMES)
+    calls = []
+
+    def fake_records(endpoint_type, days, page_size, meta, search):
+        calls.append(search)
+        meta.update({"results": {"total": 2}})
+        # 每条查询都返回重复记录 1，以及各自独有的一条记录
+        yield {"safetyreportid": "1"}
+        yield {"safetyreportid": f"{len(calls) + 1}"}
+
+    monkeypatch.setattr(main, "iter_fda_records", fake_records)
+    meta = {}
+    records = list(main._iter_search_results("drugs", searches, 7, None, meta))
+    assert calls == searches
+    assert [record["safetyreportid"] for record in records] == [
+        str(n) for n in range(1, len(searches) + 2)
+    ]
+    assert meta["results"]["total"] == 2 * len(searches)
+
+
+def test_watch_search_falls_back_to_local_matching():
+    assert main.build_watch_searches("drugs", ["X" * main.WATCHLIST_SEARCH_MAX_CHARS]) == []
+    assert main.build_watch_searches("drugs", []) == []